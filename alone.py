@@ -1,44 +1,240 @@
 from datetime import datetime
-from timely import Interval, MultiInterval
+from timely import Interval, MultiInterval, set_date_format, timestamp_as_timedelta
+import timely
+from collections import deque
+from itertools import groupby
+import argparse
 import csv
 import sys
 
 START_DATE = 'start_date'
 END_DATE = 'end_date'
 GROUP_KEYS = ('frame_id',)
+# rows sent to a worker process at a time
+BATCH_SIZE = 10000
 
 def extract_group_keys(row, group_keys):
 	return tuple([row[key] for key in group_keys])
 
-def read_as_dict_of_groups(input_rows, group_keys=GROUP_KEYS):
+def spell_of_row(row):
+	return Interval((row[START_DATE], row[END_DATE]))
+
+def add_spell(row):
+	row['_spell'] = spell_of_row(row)
+	return row
+
+def read_as_dict_of_groups(input_rows, group_keys=GROUP_KEYS, parse=True):
+	'''
+	With parse=False, rows are grouped without parsing their spells, e.g. to parse them in worker processes.
+	'''
 	output = {}
 	for row in input_rows:
 		key = extract_group_keys(row, group_keys)
 		if key not in output:
 			output[key] = []
-		row['_spell'] = Interval((row[START_DATE], row[END_DATE]))
-		output[key].append(row)
+		output[key].append(add_spell(row) if parse else row)
 	return output
 
+def read_as_sorted_groups(input_rows, group_keys=GROUP_KEYS, parse=True, check=True):
+	'''
+	Yields (key, rows) one group at a time. Rows of a group must be contiguous in the input.
+	With check=True, a group that appears twice raises ValueError. The check keeps every key read so far, so memory
+	grows with the number of groups as well as the largest group; with check=False it is bounded by the largest group.
+	'''
+	seen = set()
+	for (key, rows) in groupby(input_rows, lambda row: extract_group_keys(row, group_keys)):
+		if check:
+			if key in seen:
+				raise ValueError('Input is not sorted by %s: group %r appears twice.' % (', '.join(group_keys), key))
+			seen.add(key)
+		yield (key, [add_spell(row) for row in rows] if parse else list(rows))
+
 def days_alone(interval, list_of_intervals):
 	other_intervals = list_of_intervals[:]
 	other_intervals.remove(interval)
 	mi = MultiInterval(other_intervals)
 	return interval.difference(mi).length.days
 
-def tag_spells(data):
-	for group in data.keys():
-		list_of_intervals = [item['_spell'] for item in data[group]]
-		for item in data[group]:
-			item['days_alone'] = days_alone(item['_spell'], list_of_intervals)
-			del item['_spell']
+def days_alone_in_group(list_of_intervals):
+	'''
+	Same as days_alone for every interval in the list, in a single sweep over the sorted endpoints.
+	'''
+	timestamps = [interval.timestamps if not interval.is_empty else (0, 0) for interval in list_of_intervals]
+	return days_alone_of_timestamps([b for (b, e) in timestamps], [e for (b, e) in timestamps])
+
+def days_alone_of_timestamps(beginnings, ends):
+	'''
+	days_alone_in_group on parallel lists of timestamps. Spells with end <= beginning are empty.
+	'''
+	events = []
+	for (index, (beginning, end)) in enumerate(zip(beginnings, ends)):
+		if beginning < end:
+			events.append((beginning, 1, index))
+			events.append((end, -1, index))
+	events.sort()
+	alone = [0] * len(beginnings)
+	# when a single interval is active, the sum of active indexes is its index
+	active = 0
+	active_index_sum = 0
+	previous = None
+	for (t, change, index) in events:
+		if active == 1 and t > previous:
+			alone[active_index_sum] += t - previous
+		active += change
+		active_index_sum += change * index
+		previous = t
+	return [timestamp_as_timedelta(length).days for length in alone]
+
+def tag_group(rows):
+	list_of_intervals = [item['_spell'] for item in rows]
+	for (item, days) in zip(rows, days_alone_in_group(list_of_intervals)):
+		item['days_alone'] = days
+		del item['_spell']
+		yield item
+
+def tag_groups(groups):
+	for (key, rows) in groups:
+		for item in tag_group(rows):
 			yield item
 
-def main():
-    reader = csv.DictReader(sys.stdin)
-    writer = csv.DictWriter(sys.stdout, fieldnames=list(reader.fieldnames) + ['days_alone'])
+def tag_spells(data):
+	return tag_groups(data.items())
+
+def batches(groups, batch_size=BATCH_SIZE):
+	'''
+	Packs consecutive groups into lists of at least batch_size rows.
+	'''
+	batch = []
+	size = 0
+	for (key, rows) in groups:
+		batch.append(rows)
+		size += len(rows)
+		if size >= batch_size:
+			yield batch
+			batch = []
+			size = 0
+	if batch:
+		yield batch
+
+def start_worker():
+	# a forked worker inherits the parent's profile so far
+	if timely.profiler is not None:
+		timely.profiler.reset()
+
+def tag_batch(batch):
+	'''
+	Runs in a worker process on unparsed rows. Returns the tagged rows and the profile of the batch, if profiling.
+	'''
+	rows = [item for rows in batch for item in tag_group([add_spell(row) for row in rows])]
+	if timely.profiler is None:
+		return (rows, None)
+	summary = timely.profiler.summary()
+	timely.profiler.reset()
+	return (rows, summary)
+
+def collect_batch(result):
+	(rows, summary) = result.get()
+	if summary is not None and timely.profiler is not None:
+		timely.profiler.merge(summary)
+	return rows
+
+def tag_in_parallel(groups, jobs, batch_size=BATCH_SIZE):
+	'''
+	Tags unparsed groups in a pool of worker processes. Output is in the same order as tag_groups.
+	'''
+	# imported here, as most runs are serial
+	import multiprocessing
+	pool = multiprocessing.Pool(jobs, initializer=start_worker)
+	try:
+		# a bounded window of batches in flight keeps memory bounded for streamed input
+		pending = deque()
+		for batch in batches(groups, batch_size):
+			pending.append(pool.apply_async(tag_batch, (batch,)))
+			if len(pending) >= 2 * jobs:
+				for item in collect_batch(pending.popleft()):
+					yield item
+		while pending:
+			for item in collect_batch(pending.popleft()):
+				yield item
+	finally:
+		pool.terminate()
+		pool.join()
+
+def tag_binary(spells):
+	'''
+	Tags a SpellFile loaded by spellfile.load, one group at a time. Yields rows with the group keys and the spell.
+	'''
+	# spellfile imports this module
+	from spellfile import format_timestamp
+	for (key, intervals) in spells.groups():
+		days = days_alone_of_timestamps(intervals.beginning.tolist(), intervals.end.tolist())
+		for (beginning, end, days_alone) in zip(intervals.beginning.tolist(), intervals.end.tolist(), days):
+			row = dict(zip(spells.group_keys, key))
+			row[START_DATE] = format_timestamp(beginning)
+			row[END_DATE] = format_timestamp(end)
+			row['days_alone'] = days_alone
+			yield row
+
+def add_sorted_argument(parser):
+    parser.add_argument('--sorted', action='store_true', help='input is sorted by %s; process one group at a time in bounded memory' % ', '.join(GROUP_KEYS))
+
+def add_check_argument(parser):
+    parser.add_argument('--no-check', dest='check', action='store_false', help='do not check that sorted input has each group only once. '
+        'The check keeps every key read, so memory grows with the number of groups; without it memory is bounded by the largest group')
+
+def add_date_format_argument(parser):
+    parser.add_argument('--date-format', help='strptime format of %s and %s, tried before ISO-8601 and dateutil' % (START_DATE, END_DATE))
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Counts the days each spell is the only one in its group. Reads CSV from stdin, writes CSV to stdout.')
+    add_sorted_argument(parser)
+    add_check_argument(parser)
+    add_date_format_argument(parser)
+    parser.add_argument('--jobs', type=int, default=1, help='number of worker processes, 0 for one per CPU (default: 1)')
+    parser.add_argument('--binary', metavar='PATH', help='read spells from a binary spell file written by spellfile.py instead of stdin. '
+        'Spell files only hold %s, %s and %s, so other columns of the original CSV are not in the output. Cannot be combined with --sorted or --jobs' % (', '.join(GROUP_KEYS), START_DATE, END_DATE))
+    parser.add_argument('--profile', action='store_true', help='print time spent in each stage of timely to stderr')
+    arguments = parser.parse_args(argv)
+    if arguments.binary and (arguments.sorted or arguments.jobs != 1):
+        parser.error('--binary cannot be combined with --sorted or --jobs')
+    return arguments
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.date_format:
+        set_date_format(arguments.date_format)
+    if arguments.profile:
+        timely.enable_profiling()
+    if arguments.binary:
+        import spellfile
+        spells = spellfile.load(arguments.binary)
+        fieldnames = list(spells.group_keys) + [START_DATE, END_DATE]
+        rows = tag_binary(spells)
+    else:
+        reader = csv.DictReader(sys.stdin)
+        fieldnames = list(reader.fieldnames)
+        if arguments.jobs:
+            jobs = arguments.jobs
+        else:
+            import multiprocessing
+            jobs = multiprocessing.cpu_count()
+        # worker processes parse the spells themselves
+        parse = jobs == 1
+        if arguments.sorted:
+            groups = read_as_sorted_groups(reader, parse=parse, check=arguments.check)
+        else:
+            groups = read_as_dict_of_groups(reader, parse=parse).items()
+        if parse:
+            rows = tag_groups(groups)
+        else:
+            rows = tag_in_parallel(groups, jobs)
+    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames + ['days_alone'])
     writer.writeheader()
-    writer.writerows(tag_spells(read_as_dict_of_groups(reader)))
+    # DictWriter.writerows would collect all rows in a list first
+    for row in rows:
+        writer.writerow(row)
+    if arguments.profile:
+        sys.stderr.write(timely.disable_profiling().report())
 
 if __name__ == '__main__':
     main()
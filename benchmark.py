@@ -0,0 +1,375 @@
+'''
+Benchmark suite for timely and alone.py on seeded synthetic spells. Results are written as JSON records so that
+runs can be compared.
+
+    python benchmark.py --output before.json
+    python benchmark.py --output after.json --compare before.json
+'''
+from datetime import date, datetime, timedelta
+from dateutil.parser import parse
+from timeit import default_timer
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+
+import alone
+import timely
+
+SIZES = (1000, 10000, 100000)
+# average number of spells of a group covering a day
+DENSITIES = (0.5, 2.0, 8.0)
+GROUP_SIZE = 20
+SPAN_IN_DAYS = 3650
+# binary operations are timed on at most this many pairs
+OPERATION_PAIRS = 10000
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def synthetic_rows(number_of_rows, density=2.0, group_size=GROUP_SIZE, seed=0):
+	'''
+	Rows as read by alone.py, sorted by frame_id. Each group of group_size spells covers a window of SPAN_IN_DAYS
+	'density' times on average. Dates are drawn from a fixed pool of ISO-8601 strings.
+	'''
+	generator = random.Random(seed)
+	first = date(1990, 1, 1)
+	dates = [(first + timedelta(days=day)).isoformat() for day in range(SPAN_IN_DAYS + 1)]
+	mean_length = max(1.0, density * SPAN_IN_DAYS / group_size)
+	rows = []
+	for row in range(number_of_rows):
+		start = generator.randrange(SPAN_IN_DAYS)
+		end = min(SPAN_IN_DAYS, start + 1 + int(generator.expovariate(1 / mean_length)))
+		rows.append(dict(frame_id=str(row // group_size), start_date=dates[start], end_date=dates[end]))
+	return rows
+
+def synthetic_runs(number_of_runs, seed=0):
+	'''
+	Sorted, disjoint (beginning, end) runs of integer microsecond timestamps, with sub-day endpoints.
+	'''
+	generator = random.Random(seed)
+	t = timely.datetime_as_timestamp(datetime(1990, 1, 1))
+	output = []
+	for _ in range(number_of_runs):
+		t += generator.randrange(1, 10*86400*1000000)
+		length = generator.randrange(1, 10*86400*1000000)
+		output.append((t, t+length))
+		t += length
+	return output
+
+def record(benchmark, variant, value, unit, **parameters):
+	output = dict(benchmark=benchmark, variant=variant, value=value, unit=unit)
+	output.update(parameters)
+	return output
+
+def per_second(count, function, *arguments):
+	start = default_timer()
+	function(*arguments)
+	return count / (default_timer() - start)
+
+def operations_per_second(function, a, b, repeat=5):
+	# the best of several runs is the least noisy
+	best = None
+	for _ in range(repeat):
+		start = default_timer()
+		function(a, b)
+		elapsed = default_timer() - start
+		if best is None or elapsed < best:
+			best = elapsed
+	return 1 / best
+
+def bench_parsing(rows):
+	'''
+	Rows per second read by alone.read_as_dict_of_groups with plain dateutil, with timely.parse_date on a cold cache
+	and on a warm one.
+	'''
+	results = []
+	fast_parse_date = timely.parse_date
+	try:
+		timely.parse_date = lambda string, format=None: parse(string)
+		value = per_second(len(rows), alone.read_as_dict_of_groups, [row.copy() for row in rows])
+		results.append(record('parsing', 'dateutil', value, 'rows/s', size=len(rows)))
+	finally:
+		timely.parse_date = fast_parse_date
+	timely.parse_cache.clear()
+	for variant in ['parse_date cold', 'parse_date warm']:
+		value = per_second(len(rows), alone.read_as_dict_of_groups, [row.copy() for row in rows])
+		results.append(record('parsing', variant, value, 'rows/s', size=len(rows)))
+	timely.parse_cache.clear()
+	return results
+
+def bench_construction(rows):
+	'''
+	Objects per second built from strings, from timestamps, and MultiIntervals from the spells of a group.
+	'''
+	spells = [(row['start_date'], row['end_date']) for row in rows]
+	intervals = [timely.Interval(spell) for spell in spells]
+	timestamps = [interval.timestamps for interval in intervals]
+	groups = [intervals[start:start+GROUP_SIZE] for start in range(0, len(intervals), GROUP_SIZE)]
+	results = [
+		record('construction', 'Instant from string', per_second(len(spells), lambda: [timely.Instant(b) for (b, e) in spells]), 'objects/s', size=len(rows)),
+		record('construction', 'Interval from strings', per_second(len(spells), lambda: [timely.Interval(spell) for spell in spells]), 'objects/s', size=len(rows)),
+		record('construction', 'Interval from timestamps', per_second(len(spells), lambda: [timely.Interval.from_timestamps(b, e) for (b, e) in timestamps]), 'objects/s', size=len(rows)),
+		record('construction', 'MultiInterval', per_second(len(groups), lambda: [timely.MultiInterval(group) for group in groups]), 'objects/s', size=len(rows)),
+	]
+	return results
+
+def bench_operations(rows, density, backends=('native', 'shapely')):
+	'''
+	Binary operations per second on pairs of Intervals, Interval and Instant, and pairs of MultiIntervals, per backend.
+	'''
+	intervals = [timely.Interval((row['start_date'], row['end_date'])) for row in rows[:OPERATION_PAIRS+1]]
+	multiintervals = [timely.MultiInterval(intervals[start:start+GROUP_SIZE]) for start in range(0, len(intervals), GROUP_SIZE)]
+	pairs = {
+		'Interval': list(zip(intervals, intervals[1:])),
+		'Instant': [(interval, other.beginning) for (interval, other) in zip(intervals, intervals[1:])],
+		'MultiInterval': list(zip(multiintervals, multiintervals[1:])),
+	}
+	results = []
+	previous = timely.backend.name
+	try:
+		for name in backends:
+			timely.use_backend(name)
+			for (kind, operands) in sorted(pairs.items()):
+				if not operands:
+					continue
+				for operation in ['union', 'intersection', 'difference', 'intersects', 'contains', 'equals', 'distance']:
+					method = getattr(timely.backend, operation)
+					value = per_second(len(operands), lambda: [method(a, b) for (a, b) in operands])
+					results.append(record('operations', '%s %s %s' % (name, kind, operation), value, 'operations/s', size=len(rows), density=density))
+	finally:
+		timely.use_backend(previous)
+	return results
+
+# runs alone.py in a fresh interpreter and reports its peak resident memory
+CHILD = 'import resource, sys, alone; alone.main(sys.argv[1:]); sys.stderr.write("%d\\n" % resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)'
+
+def run_alone(path, arguments):
+	with open(path) as stdin:
+		with open(os.devnull, 'w') as stdout:
+			start = default_timer()
+			process = subprocess.Popen([sys.executable, '-c', CHILD] + arguments, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE, cwd=HERE)
+			(_, stderr) = process.communicate()
+			elapsed = default_timer() - start
+	if process.returncode != 0:
+		raise RuntimeError('alone.py failed: %s' % stderr)
+	peak = int(stderr.strip().splitlines()[-1])
+	# ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+	if sys.platform == 'darwin':
+		peak //= 1024
+	return (elapsed, peak)
+
+def bench_alone(rows, density, modes=(('dict', []), ('sorted', ['--sorted']), ('jobs 2', ['--jobs', '2']))):
+	'''
+	End-to-end alone.py throughput and peak memory on a CSV file, for each way of running it.
+	'''
+	(handle, path) = tempfile.mkstemp(suffix='.csv')
+	try:
+		with os.fdopen(handle, 'w') as output:
+			writer = csv.DictWriter(output, fieldnames=['frame_id', 'start_date', 'end_date'])
+			writer.writeheader()
+			writer.writerows(rows)
+		results = []
+		for (mode, arguments) in modes:
+			(elapsed, peak) = run_alone(path, arguments)
+			results.append(record('alone', mode, len(rows) / elapsed, 'rows/s', size=len(rows), density=density))
+			results.append(record('alone', mode, peak, 'peak kB', size=len(rows), density=density))
+		return results
+	finally:
+		os.remove(path)
+
+class LegacyInstant(object):
+	# the attribute layout of Instant before it moved to __slots__ and integer timestamps
+	def __init__(self, t):
+		self.datetime = t
+		self.BOT = False
+		self.EOT = False
+		self.is_empty = False
+
+class LegacyInterval(object):
+	def __init__(self, b, e):
+		self.is_empty = False
+		self.beginning = LegacyInstant(b)
+		self.end = LegacyInstant(e)
+
+def object_size(obj, seen=None):
+	'''
+	Bytes held by obj and the objects it references, not counting shared singletons and attribute names.
+	'''
+	if seen is None:
+		seen = set()
+	if id(obj) in seen or obj is None or isinstance(obj, bool):
+		return 0
+	seen.add(id(obj))
+	size = sys.getsizeof(obj)
+	if isinstance(obj, dict):
+		size += sum([object_size(value, seen) for value in obj.values()])
+	if hasattr(obj, '__dict__'):
+		size += object_size(obj.__dict__, seen)
+	for cls in type(obj).__mro__:
+		for slot in getattr(cls, '__slots__', ()):
+			size += object_size(getattr(obj, slot, None), seen)
+	return size
+
+def bench_memory():
+	'''
+	Bytes per Instant and per Interval, in the legacy layout and the current one.
+	'''
+	(b, e) = (datetime(1996, 1, 1), datetime(1996, 12, 31))
+	return [
+		record('memory', 'legacy Instant', object_size(LegacyInstant(b)), 'bytes'),
+		record('memory', 'Instant', object_size(timely.Instant(b)), 'bytes'),
+		record('memory', 'legacy Interval', object_size(LegacyInterval(b, e)), 'bytes'),
+		record('memory', 'Interval', object_size(timely.Interval((b, e))), 'bytes'),
+	]
+
+def bench_timeline(number_of_runs):
+	'''
+	Set operations per second on integer microsecond timestamps (native backend) and on float days (as Shapely coordinates).
+	'''
+	(a, b) = (synthetic_runs(number_of_runs, seed=1), synthetic_runs(number_of_runs, seed=2))
+	day = 86400*1000000.0
+	(x, y) = ([(s/day, e/day) for (s, e) in a], [(s/day, e/day) for (s, e) in b])
+	results = []
+	for function in [timely.union_runs, timely.intersection_runs, timely.difference_runs]:
+		results.append(record('timeline', '%s int' % function.__name__, operations_per_second(function, a, b), 'operations/s', size=number_of_runs))
+		results.append(record('timeline', '%s float' % function.__name__, operations_per_second(function, x, y), 'operations/s', size=number_of_runs))
+	return results
+
+# a fresh interpreter that times importing alone and one alone.main, and names the optional modules it loaded
+STARTUP_CHILD = """
+import time
+start = time.time()
+import alone
+imported = time.time()
+import sys
+alone.main(sys.argv[1:])
+finished = time.time()
+loaded = set([name.split('.')[0] for name in sys.modules]) & set(%r)
+sys.stderr.write('%%f %%f %%s\\n' %% (imported - start, finished - imported, ','.join(sorted(loaded))))
+"""
+OPTIONAL_MODULES = ('shapely', 'dateutil', 'numpy', 'multiprocessing')
+STARTUP_RUNS = 20
+
+def median(values):
+	return sorted(values)[len(values) // 2]
+
+def import_time(module):
+	'''
+	Cumulative import time of 'module' in seconds as reported by python -X importtime, None before Python 3.7.
+	'''
+	if sys.version_info < (3, 7):
+		return None
+	process = subprocess.Popen([sys.executable, '-X', 'importtime', '-c', 'import %s' % module], stderr=subprocess.PIPE, cwd=HERE, universal_newlines=True)
+	(_, stderr) = process.communicate()
+	# lines are 'import time: self [us] | cumulative | imported package'
+	for line in stderr.splitlines():
+		fields = line.split('|')
+		if len(fields) == 3 and fields[2].strip() == module:
+			return int(fields[1]) / 1e6
+	return None
+
+def bench_startup(rows, runs=STARTUP_RUNS):
+	'''
+	Startup cost of alone.py on a small file: medians over fresh interpreters of the whole process, of importing alone
+	and of alone.main, and the number of OPTIONAL_MODULES it loaded.
+	'''
+	(handle, path) = tempfile.mkstemp(suffix='.csv')
+	try:
+		with os.fdopen(handle, 'w') as output:
+			writer = csv.DictWriter(output, fieldnames=['frame_id', 'start_date', 'end_date'])
+			writer.writeheader()
+			writer.writerows(rows)
+		(processes, imports, mains) = ([], [], [])
+		for run in range(runs):
+			with open(path) as stdin:
+				with open(os.devnull, 'w') as stdout:
+					start = default_timer()
+					process = subprocess.Popen([sys.executable, '-c', STARTUP_CHILD % (OPTIONAL_MODULES,)], stdin=stdin, stdout=stdout, stderr=subprocess.PIPE, cwd=HERE, universal_newlines=True)
+					(_, stderr) = process.communicate()
+					processes.append(default_timer() - start)
+			if process.returncode != 0:
+				raise RuntimeError('alone.py failed: %s' % stderr)
+			(imported, main, loaded) = stderr.splitlines()[-1].split(' ')
+			imports.append(float(imported))
+			mains.append(float(main))
+	finally:
+		os.remove(path)
+	results = [record('startup', 'process', median(processes) * 1000, 'ms', size=len(rows)),
+		record('startup', 'import alone', median(imports) * 1000, 'ms', size=len(rows)),
+		record('startup', 'alone.main', median(mains) * 1000, 'ms', size=len(rows)),
+		record('startup', 'optional modules loaded', len([name for name in loaded.split(',') if name]), 'modules', size=len(rows))]
+	seconds = import_time('alone')
+	if seconds is not None:
+		results.append(record('startup', 'import alone (-X importtime)', seconds * 1000, 'ms', size=len(rows)))
+	return results
+
+BENCHMARKS = ('parsing', 'construction', 'operations', 'alone', 'memory', 'timeline', 'startup')
+
+def run(sizes=SIZES, densities=DENSITIES, benchmarks=BENCHMARKS, seed=0):
+	results = []
+	if 'memory' in benchmarks:
+		results.extend(bench_memory())
+	if 'startup' in benchmarks:
+		# a single small firm, as the batch scheduler runs alone.py
+		results.extend(bench_startup(synthetic_rows(GROUP_SIZE, seed=seed)))
+	for size in sizes:
+		if 'timeline' in benchmarks:
+			results.extend(bench_timeline(size))
+		for (position, density) in enumerate(densities):
+			rows = synthetic_rows(size, density=density, seed=seed)
+			# parsing and construction do not depend on how much spells overlap
+			if position == 0 and 'parsing' in benchmarks:
+				results.extend(bench_parsing(rows))
+			if position == 0 and 'construction' in benchmarks:
+				results.extend(bench_construction(rows))
+			if 'operations' in benchmarks:
+				results.extend(bench_operations(rows, density))
+			if 'alone' in benchmarks:
+				results.extend(bench_alone(rows, density))
+	return dict(metadata=dict(python=platform.python_version(), platform=platform.platform(), date=datetime.now().isoformat(), seed=seed, sizes=list(sizes), densities=list(densities)), results=results)
+
+def record_key(item):
+	return tuple([(name, item[name]) for name in sorted(item) if name != 'value'])
+
+def compare(old, new):
+	'''
+	Lines of new/old ratios for the records present in both runs.
+	'''
+	old_values = dict((record_key(item), item['value']) for item in old['results'])
+	lines = []
+	for item in new['results']:
+		key = record_key(item)
+		if key in old_values and old_values[key]:
+			parameters = ' '.join(['%s=%s' % (name, item[name]) for name in ('size', 'density') if name in item])
+			lines.append('%-12s %-40s %-24s %8.2fx %s' % (item['benchmark'], item['variant'], parameters, float(item['value']) / old_values[key], item['unit']))
+	return lines
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Benchmarks timely and alone.py on seeded synthetic spells.')
+	parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='comma-separated numbers of spells (default: %(default)s)')
+	parser.add_argument('--densities', default=','.join(map(str, DENSITIES)), help='comma-separated overlap densities (default: %(default)s)')
+	parser.add_argument('--benchmarks', default=','.join(BENCHMARKS), help='comma-separated benchmarks to run (default: %(default)s)')
+	parser.add_argument('--seed', type=int, default=0)
+	parser.add_argument('--output', default='-', help='JSON file to write, - for stdout (default)')
+	parser.add_argument('--compare', help='JSON file of an earlier run to print ratios against, on stderr')
+	arguments = parser.parse_args(argv)
+	results = run(sizes=[int(size) for size in arguments.sizes.split(',')],
+		densities=[float(density) for density in arguments.densities.split(',')],
+		benchmarks=arguments.benchmarks.split(','), seed=arguments.seed)
+	if arguments.output == '-':
+		json.dump(results, sys.stdout, indent=1, sort_keys=True)
+		sys.stdout.write('\n')
+	else:
+		with open(arguments.output, 'w') as output:
+			json.dump(results, output, indent=1, sort_keys=True)
+	if arguments.compare:
+		with open(arguments.compare) as previous:
+			for line in compare(json.load(previous), results):
+				sys.stderr.write(line + '\n')
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,76 @@
+'''
+Merges the spells of each group that overlap, touch or are separated by a short gap, before alone.py or any overlap
+analysis. Input must be sorted by the group keys; only the rows of the current group are held in memory.
+
+    python coalesce.py --gap 1 --aggregate wage=sum --aggregate records=count < spells.csv > merged.csv
+'''
+from timely import coalesce, set_date_format
+from alone import END_DATE, GROUP_KEYS, extract_group_keys, spell_of_row, add_check_argument, add_date_format_argument
+from datetime import timedelta
+import argparse
+import csv
+import sys
+
+def _number(value):
+	return int(value) if value.is_integer() else value
+
+# functions of the column values of the merged rows, in order of their beginning
+AGGREGATES = {
+	'first': lambda values: values[0],
+	'last': lambda values: values[-1],
+	'sum': lambda values: _number(sum([float(value) for value in values])),
+	'min': lambda values: min(values, key=float),
+	'max': lambda values: max(values, key=float),
+	'count': len,
+}
+
+def merge_rows(rows, aggregates=None):
+	'''
+	One row for merged rows: the beginning of the first, the latest end, and other columns aggregated by the name of
+	a function in AGGREGATES for each column in 'aggregates', otherwise taken from the first row.
+	'''
+	aggregates = aggregates or {}
+	output = dict(rows[0])
+	output[END_DATE] = max(rows, key=lambda row: spell_of_row(row).timestamps[1])[END_DATE]
+	for (column, name) in aggregates.items():
+		output[column] = AGGREGATES[name]([row.get(column) for row in rows])
+	return output
+
+def coalesce_rows(input_rows, gap=timedelta(0), group_keys=GROUP_KEYS, aggregates=None, check=True):
+	'''
+	Yields a merged row for each run of spells of a group no more than 'gap' apart, and each row with an empty spell
+	(end on or before start) on its own, after the merged rows of its group, as alone.py keeps such rows too.
+	check is passed to timely.coalesce.
+	'''
+	merged = coalesce(input_rows, gap, key=lambda row: extract_group_keys(row, group_keys), spell=spell_of_row, check=check)
+	for (key, spell, rows) in merged:
+		yield merge_rows(rows, aggregates)
+
+def parse_aggregate(text):
+	(column, separator, name) = text.partition('=')
+	if not separator or name not in AGGREGATES:
+		raise argparse.ArgumentTypeError('expected COLUMN=FUNCTION with FUNCTION one of %s' % ', '.join(sorted(AGGREGATES)))
+	return (column, name)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Merges the spells of each %s that are at most --gap days apart. Reads CSV sorted by %s from stdin, writes CSV to stdout.' % (', '.join(GROUP_KEYS), ', '.join(GROUP_KEYS)))
+    parser.add_argument('--gap', type=float, default=0, help='largest gap in days between spells that are merged (default: 0, merge overlapping and touching spells)')
+    parser.add_argument('--aggregate', metavar='COLUMN=FUNCTION', type=parse_aggregate, action='append', default=[], help='aggregate a column of merged rows with one of %s; other columns are taken from the first spell. A new column such as records=count is added to the output' % ', '.join(sorted(AGGREGATES)))
+    add_check_argument(parser)
+    add_date_format_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.date_format:
+        set_date_format(arguments.date_format)
+    aggregates = dict(arguments.aggregate)
+    reader = csv.DictReader(sys.stdin)
+    fieldnames = list(reader.fieldnames) + [column for (column, name) in arguments.aggregate if column not in reader.fieldnames]
+    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+    writer.writeheader()
+    for row in coalesce_rows(reader, timedelta(days=arguments.gap), aggregates=aggregates, check=arguments.check):
+        writer.writerow(row)
+
+if __name__ == '__main__':
+    main()
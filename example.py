@@ -14,12 +14,14 @@ two_workers_overlapped = worker_spell.intersects(other_worker_spell)
 sample_period = timely.MultiInterval([year_1996, worker_spell, other_worker_spell]).envelope
 # = Interval(('1996-01-01', ''))
 
+# Cut the sample period at every hire and separation.
+events = [spell.beginning for spell in [worker_spell, other_worker_spell]] + [spell.end for spell in [worker_spell, other_worker_spell]]
+segments = list(sample_period.split(events))
+
 # A more advanced example. Count the number of workers at the firm over time.
 worker_spells = [worker_spell, other_worker_spell]
-sample_period = timely.MultiInterval(worker_spells).envelope
-events = [spell.beginning for spell in worker_spells] + [spell.end for spell in worker_spells]
-segments = sample_period.split(events)
+output = [dict(time_period=segment, number_of_workers=count) for (segment, count) in timely.coverage_counts(worker_spells)]
 
-output = []
-for segment in segments:
-	output.append(dict(time_period=segment, number_of_workers=sum([1 for spell in worker_spells if spell.intersects(segment)])))
\ No newline at end of file
+# The same, for many firms at once.
+firm_spells = [('firm A', worker_spell), ('firm A', other_worker_spell), ('firm B', year_1996)]
+output_by_firm = timely.coverage_counts(firm_spells, key=lambda item: item[0], spell=lambda item: item[1])
\ No newline at end of file
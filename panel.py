@@ -0,0 +1,66 @@
+'''
+Turns spells into a group x period panel: the spell days, the number of active spells and, optionally, the weighted
+spell days of each group in each month, quarter or year.
+
+    python panel.py --frequency quarter --weight wage < spells.csv > panel.csv
+'''
+from timely import Interval, period_totals, set_date_format, PERIODS_PER_YEAR
+from alone import GROUP_KEYS, extract_group_keys, read_as_sorted_groups, spell_of_row, add_sorted_argument, add_check_argument, add_date_format_argument
+import argparse
+import csv
+import sys
+
+def panel_rows(input_rows, frequency='month', group_keys=GROUP_KEYS, weight=None, window=None):
+	'''
+	Yields a dict for each group and period with the group keys, period, days, active and, with a weight column,
+	weighted.
+	'''
+	totals = period_totals(input_rows, frequency, key=lambda row: extract_group_keys(row, group_keys), spell=spell_of_row,
+		weight=(lambda row: float(row[weight])) if weight else None, window=window)
+	for (key, period, days, active, weighted) in totals:
+		row = dict(zip(group_keys, key))
+		row.update(period=period, days=days, active=active)
+		if weight:
+			row['weighted'] = weighted
+		yield row
+
+def sorted_panel_rows(input_rows, frequency='month', group_keys=GROUP_KEYS, weight=None, window=None, check=True):
+	'''
+	Same as panel_rows on input sorted by the group keys, holding one group in memory at a time. check is passed to
+	read_as_sorted_groups.
+	'''
+	for (key, rows) in read_as_sorted_groups(input_rows, group_keys, parse=False, check=check):
+		for row in panel_rows(rows, frequency, group_keys, weight, window):
+			yield row
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Sums spell days by %s and calendar period. Reads CSV from stdin, writes CSV to stdout.' % ', '.join(GROUP_KEYS))
+    parser.add_argument('--frequency', choices=sorted(PERIODS_PER_YEAR), default='month', help='length of the periods (default: month)')
+    parser.add_argument('--weight', metavar='COLUMN', help='numeric column to weight spell days with, summed as weighted')
+    parser.add_argument('--from', dest='beginning', default='', help='clip spells to begin no earlier than this date; required if a spell has an open beginning')
+    parser.add_argument('--to', dest='end', default='', help='clip spells to end no later than this date; required if a spell has an open end')
+    add_sorted_argument(parser)
+    add_check_argument(parser)
+    add_date_format_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.date_format:
+        set_date_format(arguments.date_format)
+    window = None
+    if arguments.beginning or arguments.end:
+        window = Interval((arguments.beginning, arguments.end))
+    reader = csv.DictReader(sys.stdin)
+    fieldnames = list(GROUP_KEYS) + ['period', 'days', 'active'] + (['weighted'] if arguments.weight else [])
+    writer = csv.DictWriter(sys.stdout, fieldnames=fieldnames)
+    writer.writeheader()
+    if arguments.sorted:
+        rows = sorted_panel_rows(reader, arguments.frequency, weight=arguments.weight, window=window, check=arguments.check)
+    else:
+        rows = panel_rows(reader, arguments.frequency, weight=arguments.weight, window=window)
+    for row in rows:
+        writer.writerow(row)
+
+if __name__ == '__main__':
+    main()
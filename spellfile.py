@@ -0,0 +1,261 @@
+'''
+Binary spell files: a small header and fixed-width int64 columns of timestamps that load through numpy.memmap
+without parsing or copying.
+
+    python spellfile.py to-binary spells.bin < spells.csv
+    python spellfile.py to-csv spells.bin > spells.csv
+    python alone.py --binary spells.bin > tagged.csv
+
+Layout, all little-endian:
+    8 bytes     MAGIC
+    8 bytes     length of the JSON header, a multiple of 8
+    header      JSON: version, count, columns, group_keys and the list of distinct keys, byte strings as Latin-1
+    columns     count int64 values each: beginning, end and, with group keys, the index of each key in keys
+Beginnings and ends are timely timestamps, with BOT_TIMESTAMP and EOT_TIMESTAMP for open ends. Only the group
+keys and the spell are stored, other CSV columns are dropped.
+'''
+from timely import IntervalArray, Instant, BOT_TIMESTAMP, EOT_TIMESTAMP, timestamp_as_datetime, set_date_format
+from alone import START_DATE, END_DATE, GROUP_KEYS, extract_group_keys, add_date_format_argument
+import argparse
+import csv
+import json
+import shutil
+import struct
+import sys
+import tempfile
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+MAGIC = b'TIMELY\x00\x01'
+VERSION = 1
+DTYPE = '<i8'
+# values buffered per column before they are written out
+CHUNK_SIZE = 65536
+_LENGTH = struct.Struct('<Q')
+
+def _require_numpy():
+	if numpy is None:
+		raise ImportError('Spell files require NumPy.')
+
+def read_header(stream):
+	'''
+	Reads and checks the header of an open spell file. Adds 'offset', the position of the first column.
+	'''
+	if stream.read(len(MAGIC)) != MAGIC:
+		raise ValueError('Not a spell file.')
+	(length,) = _LENGTH.unpack(stream.read(_LENGTH.size))
+	header = json.loads(stream.read(length).decode('utf-8'))
+	if header['version'] != VERSION:
+		raise ValueError('Unsupported spell file version %r.' % header['version'])
+	header['offset'] = len(MAGIC) + _LENGTH.size + length
+	return header
+
+def _key_as_json(key):
+	# Latin-1 maps every byte to a character, so byte strings in any encoding survive JSON unchanged
+	return [value.decode('latin-1') if isinstance(value, bytes) else value for value in key]
+
+def _key_of_json(values):
+	return tuple([value.encode('latin-1') if isinstance(value, unicode) else value for value in values])
+
+def _write_header(stream, count, group_keys, keys):
+	columns = ['beginning', 'end'] + (['key'] if group_keys else [])
+	header = json.dumps(dict(version=VERSION, count=count, columns=columns,
+		group_keys=_key_as_json(group_keys or ()), keys=[_key_as_json(key) for key in keys])).encode('utf-8')
+	# padding keeps the int64 columns aligned
+	header += b' ' * (-len(header) % 8)
+	stream.write(MAGIC)
+	stream.write(_LENGTH.pack(len(header)))
+	stream.write(header)
+
+class SpellFile(object):
+	'''
+	The contents of a spell file. intervals is an IntervalArray over the memory map; codes, if the file has group
+	keys, is the index of each spell's key in keys.
+	'''
+	def __init__(self, intervals, codes=None, keys=(), group_keys=()):
+		self.intervals = intervals
+		self.codes = codes
+		self.keys = keys
+		self.group_keys = group_keys
+
+	def __len__(self):
+		return len(self.intervals)
+
+	def groups(self):
+		'''
+		Yields (key, IntervalArray) for each key in order of first appearance, spells in file order.
+		'''
+		if self.codes is None:
+			yield ((), self.intervals)
+			return
+		if not len(self.codes):
+			return
+		# a stable sort keeps the spells of a key in file order
+		order = numpy.argsort(self.codes, kind='mergesort')
+		boundaries = numpy.flatnonzero(numpy.diff(self.codes[order])) + 1
+		for indexes in numpy.split(order, boundaries):
+			yield (self.keys[int(self.codes[indexes[0]])], self.intervals[indexes])
+
+def load(path):
+	'''
+	Maps a spell file into memory. The columns are read from disk on demand and never copied.
+	'''
+	_require_numpy()
+	with open(path, 'rb') as stream:
+		header = read_header(stream)
+	(count, columns) = (header['count'], header['columns'])
+	if count:
+		data = numpy.memmap(path, dtype=DTYPE, mode='r', offset=header['offset'], shape=(len(columns), count))
+	else:
+		# an empty file region cannot be mapped
+		data = numpy.empty((len(columns), 0), dtype=DTYPE)
+	codes = data[columns.index('key')] if 'key' in columns else None
+	keys = [_key_of_json(key) for key in header['keys']]
+	return SpellFile(IntervalArray(data[0], data[1]), codes, keys, _key_of_json(header['group_keys']))
+
+class SpellWriter(object):
+	'''
+	Writes spells one at a time in bounded memory. Columns are spooled to temporary files and joined behind the
+	header on close, once the count and the keys are known.
+	'''
+	def __init__(self, path, group_keys=()):
+		_require_numpy()
+		self.path = path
+		self.group_keys = tuple(group_keys or ())
+		self.keys = []
+		self._codes = {}
+		self.count = 0
+		self._columns = [tempfile.TemporaryFile() for column in range(3 if self.group_keys else 2)]
+		self._buffers = [[] for column in self._columns]
+
+	def write(self, beginning, end, key=None):
+		'''
+		Adds a spell given by its timestamps. key is a tuple with a value for each group key.
+		'''
+		values = [beginning, end]
+		if self.group_keys:
+			if key not in self._codes:
+				self._codes[key] = len(self.keys)
+				self.keys.append(key)
+			values.append(self._codes[key])
+		for (buffer, value) in zip(self._buffers, values):
+			buffer.append(value)
+		self.count += 1
+		if len(self._buffers[0]) >= CHUNK_SIZE:
+			self._flush()
+
+	def _flush(self):
+		for (column, buffer) in zip(self._columns, self._buffers):
+			column.write(numpy.array(buffer, dtype=DTYPE).tobytes())
+			del buffer[:]
+
+	def close(self):
+		self._flush()
+		with open(self.path, 'wb') as output:
+			_write_header(output, self.count, self.group_keys, self.keys)
+			for column in self._columns:
+				column.seek(0)
+				shutil.copyfileobj(column, output)
+				column.close()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exception):
+		if exception[0] is None:
+			self.close()
+		else:
+			for column in self._columns:
+				column.close()
+
+def save(path, intervals, keys=None, group_keys=()):
+	'''
+	Writes an IntervalArray or a list of Intervals, with an optional parallel list of key tuples.
+	'''
+	_require_numpy()
+	if not isinstance(intervals, IntervalArray):
+		intervals = IntervalArray.from_intervals(intervals)
+	columns = [intervals.beginning, intervals.end]
+	distinct = []
+	if group_keys:
+		codes = {}
+		for key in keys:
+			if key not in codes:
+				codes[key] = len(distinct)
+				distinct.append(key)
+		columns.append([codes[key] for key in keys])
+	with open(path, 'wb') as output:
+		_write_header(output, len(intervals), group_keys, distinct)
+		for column in columns:
+			output.write(numpy.asarray(column, dtype=DTYPE).tobytes())
+
+def parse_timestamps(row):
+	'''
+	The timestamps of a CSV row's spell as they are written, open ends filled in but empty spells kept as they are.
+	'''
+	beginning = Instant(row[START_DATE]).timestamp
+	end = Instant(row[END_DATE]).timestamp
+	return (BOT_TIMESTAMP if beginning is None else beginning, EOT_TIMESTAMP if end is None else end)
+
+def format_timestamp(timestamp):
+	'''
+	The CSV value of a timestamp: empty for an open end, a date at midnight and an ISO-8601 datetime otherwise.
+	'''
+	if timestamp in (BOT_TIMESTAMP, EOT_TIMESTAMP):
+		return ''
+	moment = timestamp_as_datetime(timestamp)
+	if moment.time() == moment.min.time():
+		return moment.date().isoformat()
+	return moment.isoformat()
+
+def csv_to_binary(input_rows, path, group_keys=GROUP_KEYS):
+	'''
+	Converts the rows alone.py reads into a spell file in a single pass. Returns the number of spells.
+	'''
+	with SpellWriter(path, group_keys) as writer:
+		for row in input_rows:
+			(beginning, end) = parse_timestamps(row)
+			writer.write(beginning, end, extract_group_keys(row, group_keys) if group_keys else None)
+	return writer.count
+
+def binary_to_rows(spells):
+	'''
+	Yields a dict for each spell of a SpellFile, with its group keys, START_DATE and END_DATE, in file order.
+	'''
+	beginnings = spells.intervals.beginning
+	ends = spells.intervals.end
+	for index in range(len(spells)):
+		row = {}
+		if spells.codes is not None:
+			row.update(zip(spells.group_keys, spells.keys[int(spells.codes[index])]))
+		row[START_DATE] = format_timestamp(int(beginnings[index]))
+		row[END_DATE] = format_timestamp(int(ends[index]))
+		yield row
+
+def binary_to_csv(path, output):
+	spells = load(path)
+	writer = csv.DictWriter(output, fieldnames=list(spells.group_keys) + [START_DATE, END_DATE])
+	writer.writeheader()
+	for row in binary_to_rows(spells):
+		writer.writerow(row)
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description='Converts between the CSV format of alone.py and binary spell files.')
+    parser.add_argument('direction', choices=('to-binary', 'to-csv'), help='to-binary reads CSV from stdin, to-csv writes CSV to stdout')
+    parser.add_argument('path', help='the spell file')
+    add_date_format_argument(parser)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    arguments = parse_arguments(argv)
+    if arguments.date_format:
+        set_date_format(arguments.date_format)
+    if arguments.direction == 'to-binary':
+        csv_to_binary(csv.DictReader(sys.stdin), arguments.path)
+    else:
+        binary_to_csv(arguments.path, sys.stdout)
+
+if __name__ == '__main__':
+    main()
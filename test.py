@@ -1,11 +1,33 @@
 import timely as module
+import bisect
+import os
+import pickle
+import random
+import subprocess
+import sys
 import unittest
-from datetime import timedelta
+from datetime import datetime, timedelta
 from shapely.geometry import Point, LineString
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 def equal(self, desired, actual):
     self.assertEqual(desired, actual, msg='\n%s\n%s' % (desired, actual))
 
+def as_intervals(spells):
+    return [module.Interval(spell) for spell in spells]
+
+def overlapping(intervals, other):
+    return sorted([interval.timestamps for interval in intervals if interval.intersects(other)])
+
+# one overlapping, one open and one empty spell, for the vectorized functions
+ARRAY_SPELLS = [('1996-01-01', '1996-01-03'), ('1996-01-02', '1996-01-08'), ('1996-01-07', ''), ('1996-01-08', '1996-01-01')]
+# overlapping, disjoint, open and duplicate spells, for the interval index and the timeline
+SPELLS = [('1996-01-01', '1996-01-03'), ('1996-01-02', '1996-01-08'), ('1996-01-07', '1996-01-10'),
+          ('1996-02-01', '1996-02-10'), ('1996-03-01', ''), ('', '1995-06-01'), ('1996-01-02', '1996-01-08')]
+
 class TestConversionFunctions(unittest.TestCase):
     def test_x_is_float(self):
         dt = timedelta(days=1)
@@ -24,6 +46,9 @@ class TestConversionFunctions(unittest.TestCase):
         for x in [1.0,2.0,3.0]:
             self.assertEqual(module.timedelta_as_x(module.x_as_timedelta(x)), x)
 
+    def test_x_keeps_time_of_day(self):
+        self.assertEqual(module.timedelta_as_x(timedelta(hours=12)), 0.5)
+
     def test_instant_becomes_point(self):
         t = module.Instant('1996-01-12')
         self.assertEqual(module.time_as_shape(t).geom_type, 'Point')
@@ -108,7 +133,60 @@ class TestInterval(unittest.TestCase):
         self.assertEqual(unicode(interval), u'2007-03-01T13:00:00/2008-05-11T15:30:00')
 
 class TestMultiInstant(unittest.TestCase):
-    pass
+    def multiinstant(self):
+        return module.MultiInstant(['1996-01-05', module.Instant('1996-01-01'), datetime(1996, 1, 3), '1996-01-05', ''])
+
+    def test_sorted_and_distinct(self):
+        actual = unicode(self.multiinstant())
+        self.assertEqual(actual, u'1996-01-01T00:00:00,1996-01-03T00:00:00,1996-01-05T00:00:00')
+
+    def test_from_strings(self):
+        actual = module.MultiInstant.from_strings(['05/01/1996', '01/01/1996', '03/01/1996', '01/01/1996'], '%d/%m/%Y')
+        self.assertListEqual(actual.timestamps, self.multiinstant().timestamps)
+
+    def test_contains(self):
+        self.failUnless(module.Instant('1996-01-03') in self.multiinstant())
+        self.failIf(module.Instant('1996-01-04') in self.multiinstant())
+
+    def test_within_interval(self):
+        actual = self.multiinstant().within(module.Interval(('1996-01-03', '1996-01-10')))
+        self.assertEqual(unicode(actual), u'1996-01-03T00:00:00,1996-01-05T00:00:00')
+
+    def test_within_multiinterval(self):
+        mi = module.MultiInterval([module.Interval(('1995-01-01', '1996-01-02')), module.Interval(('1996-01-04', '1996-01-06'))])
+        actual = self.multiinstant().within(mi)
+        self.assertEqual(unicode(actual), u'1996-01-01T00:00:00,1996-01-05T00:00:00')
+
+    def test_union(self):
+        other = module.MultiInstant(['1996-01-02', '1996-01-03'])
+        actual = self.multiinstant().union(other)
+        self.failUnless(isinstance(actual, module.MultiInstant))
+        self.assertEqual(len(actual), 4)
+
+    def test_intersection(self):
+        other = module.MultiInstant(['1996-01-02', '1996-01-03', '1996-01-05'])
+        actual = self.multiinstant().intersection(other)
+        self.assertEqual(unicode(actual), u'1996-01-03T00:00:00,1996-01-05T00:00:00')
+
+    def test_difference(self):
+        other = module.MultiInstant(['1996-01-03'])
+        actual = self.multiinstant().difference(other)
+        self.assertEqual(unicode(actual), u'1996-01-01T00:00:00,1996-01-05T00:00:00')
+
+    def test_difference_with_interval(self):
+        actual = self.multiinstant().difference(module.Interval(('1996-01-02', '1996-01-10')))
+        self.assertEqual(actual, module.Instant('1996-01-01'))
+
+    def test_same_as_shapely(self):
+        other = module.MultiInstant(['1996-01-02', '1996-01-03'])
+        for operation in ['union', 'intersection', 'difference']:
+            desired = getattr(module.ShapelyBackend(), operation)(self.multiinstant(), other)
+            actual = getattr(module.NativeBackend(), operation)(self.multiinstant(), other)
+            self.assertEqual(unicode(desired), unicode(actual))
+
+    def test_split_interval(self):
+        interval = module.Interval(('1996-01-02', '1996-01-10'))
+        self.assertEqual(len(list(interval.split(self.multiinstant()))), 3)
 
 class TestMultiInterval(unittest.TestCase):
     def test_create_from_intervals(self):
@@ -124,6 +202,34 @@ class TestMultiInterval(unittest.TestCase):
         desired = (interval1.beginning, interval2.end)
         equal(self, desired, actual)
 
+    def test_normalized(self):
+        interval1 = module.Interval(('1996-01-05', '1996-01-08'))
+        interval2 = module.Interval(('1996-01-01', '1996-01-03'))
+        interval3 = module.Interval(('1996-01-02', '1996-01-04'))
+        interval4 = module.Interval(('1996-01-08', '1996-01-09'))
+        actual = [unicode(interval) for interval in module.MultiInterval([interval1, interval2, interval3, interval4]).intervals]
+        self.assertListEqual(actual, [u'1996-01-01T00:00:00/1996-01-04T00:00:00', u'1996-01-05T00:00:00/1996-01-09T00:00:00'])
+
+    def test_empty(self):
+        self.failUnless(module.MultiInterval([]).is_empty)
+        self.failUnless(module.MultiInterval([module.Interval(('1996-01-03', '1996-01-01'))]).is_empty)
+
+    def test_run_at(self):
+        mi = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-07', '1996-01-08'))])
+        self.assertEqual(mi.run_at(module.Instant('1996-01-03').timestamp), mi.intervals[0].timestamps)
+        self.failUnless(mi.run_at(module.Instant('1996-01-05').timestamp) is None)
+        self.failUnless(mi.run_at(module.Instant('1995-01-05').timestamp) is None)
+
+    def test_length(self):
+        mi = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-02', '1996-01-08'))])
+        self.assertEqual(mi.length, timedelta(days=7))
+
+    def test_union_of_multiintervals(self):
+        mi1 = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-07', '1996-01-08'))])
+        mi2 = module.MultiInterval([module.Interval(('1996-01-03', '1996-01-05')), module.Interval(('1996-01-10', '1996-01-12'))])
+        desired = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-05')), module.Interval(('1996-01-07', '1996-01-08')), module.Interval(('1996-01-10', '1996-01-12'))])
+        equal(self, desired, mi1.union(mi2))
+
 class TestInstantRelation(unittest.TestCase):
     def test_instant_equal(self):
         instant1 = module.Instant('1996-01-01')
@@ -247,8 +353,885 @@ class TestOperation(unittest.TestCase):
         instant = module.Instant('1996-01-02')
         desired1 = module.Interval(('1996-01-01', '1996-01-02'))
         desired2 = module.Interval(('1996-01-02', '1996-01-03'))
-        actual = interval.split(instant)
-        equal(self, module.MultiInterval([desired1, desired2]), actual)
+        actual = list(interval.split(instant))
+        equal(self, [desired1, desired2], actual)
+
+    def test_split_at_many_instants(self):
+        interval = module.Interval(('1996-01-01', '1996-01-10'))
+        instants = [module.Instant('1996-01-05'), '1996-01-03', module.Instant('1996-01-05'), module.Instant('1996-01-01'), '1997-01-01']
+        actual = [unicode(segment) for segment in interval.split(instants)]
+        desired = [u'1996-01-01T00:00:00/1996-01-03T00:00:00', u'1996-01-03T00:00:00/1996-01-05T00:00:00', u'1996-01-05T00:00:00/1996-01-10T00:00:00']
+        self.assertListEqual(actual, desired)
+
+    def test_split_is_lazy(self):
+        interval = module.Interval(('1996-01-01', ''))
+        days = (module.Instant.from_timestamp(interval.timestamps[0] + day * 86400 * 1000000) for day in range(1, 1000))
+        segments = interval.split(days)
+        self.assertEqual(next(segments), module.Interval(('1996-01-01', '1996-01-02')))
+
+    def test_split_at_single_cut(self):
+        interval = module.Interval(('1996-01-01', '1996-01-10'))
+        desired = [module.Interval(('1996-01-01', '1996-01-05')), module.Interval(('1996-01-05', '1996-01-10'))]
+        self.assertListEqual(list(interval.split('1996-01-05')), desired)
+        self.assertListEqual(list(interval.split(datetime(1996, 1, 5))), desired)
+        self.assertListEqual(list(interval.split(module.Instant('1996-01-05'))), desired)
+
+    def test_split_without_cuts(self):
+        interval = module.Interval(('1996-01-01', '1996-01-03'))
+        self.assertEqual(list(interval.split([])), [interval])
+        self.assertEqual(list(module.Interval(('1996-01-03', '1996-01-01')).split([])), [])
+
+class TestShapelyBackend(unittest.TestCase):
+    def setUp(self):
+        self.previous = module.use_backend('shapely')
+
+    def tearDown(self):
+        module.use_backend(self.previous)
+
+    def fixtures(self):
+        interval1 = module.Interval(('1996-01-01', '1996-01-03'))
+        interval2 = module.Interval(('1996-01-02', '1996-01-08'))
+        interval3 = module.Interval(('1996-01-07', '1996-01-10'))
+        interval4 = module.Interval(('1996-01-04', '1996-01-06'))
+        mi1 = module.MultiInterval([interval1, interval3])
+        mi2 = module.MultiInterval([interval2, module.Interval(('1996-02-01', '1996-02-10'))])
+        instant = module.Instant('1996-01-02')
+        return [interval1, interval2, interval3, interval4, mi1, mi2, instant]
+
+    def cross_check(self, operation, fixtures=None):
+        fixtures = fixtures or self.fixtures()
+        for a in fixtures:
+            for b in fixtures:
+                desired = getattr(module.ShapelyBackend(), operation)(a, b)
+                actual = getattr(module.NativeBackend(), operation)(a, b)
+                if isinstance(desired, module.TimelyObject):
+                    self.failUnless(module.NativeBackend().equals(desired, actual), msg='%s(%s, %s)\n%s\n%s' % (operation, a, b, desired, actual))
+                else:
+                    self.assertEqual(desired, actual, msg='%s(%s, %s)' % (operation, a, b))
+
+    def test_backend_is_shapely(self):
+        self.assertEqual(module.backend.name, 'shapely')
+
+    def test_same_relations(self):
+        for operation in ['equals', 'contains', 'disjoint', 'intersects', 'distance']:
+            self.cross_check(operation)
+
+    def test_same_union(self):
+        # Shapely returns a GeometryCollection for an interval and an outside point
+        self.cross_check('union', [item for item in self.fixtures() if not isinstance(item, module.Instant)])
+
+    def test_same_intersection(self):
+        self.cross_check('intersection', [item for item in self.fixtures() if not isinstance(item, module.Instant)])
+
+    def test_same_difference(self):
+        self.cross_check('difference')
+
+    def test_same_length(self):
+        for a in self.fixtures():
+            self.assertEqual(module.ShapelyBackend().length(a), module.NativeBackend().length(a))
+
+    def test_interval_intersection(self):
+        interval1 = module.Interval(('1996-01-01', '1996-01-03'))
+        interval2 = module.Interval(('1996-01-02', '1996-01-08'))
+        actual = interval1.intersection(interval2)
+        desired = module.Interval(('1996-01-02', '1996-01-03'))
+        self.assertEqual(desired, actual, msg='\n%s\n%s' % (desired, actual))
+
+class TestNativeBackend(unittest.TestCase):
+    def test_default_backend(self):
+        self.assertEqual(module.backend.name, 'native')
+
+    def test_touching_intervals_intersect_in_instant(self):
+        interval1 = module.Interval(('1996-01-01', '1996-01-03'))
+        interval2 = module.Interval(('1996-01-03', '1996-01-08'))
+        actual = interval1.intersection(interval2)
+        self.failUnless(isinstance(actual, module.Instant))
+        self.assertEqual(actual, module.Instant('1996-01-03'))
+
+    def test_difference_splits_interval(self):
+        interval1 = module.Interval(('1996-01-01', '1996-01-10'))
+        interval2 = module.Interval(('1996-01-03', '1996-01-05'))
+        actual = interval1.difference(interval2)
+        desired = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-05', '1996-01-10'))])
+        equal(self, desired, actual)
+
+    def test_distance(self):
+        interval1 = module.Interval(('1996-01-01', '1996-01-03'))
+        interval2 = module.Interval(('1996-01-07', '1996-01-08'))
+        self.assertEqual(interval1.distance(interval2), timedelta(days=4))
+
+    def test_instant_on_boundary_not_contained(self):
+        interval = module.Interval(('1996-01-01', '1996-01-03'))
+        self.failIf(module.Instant('1996-01-01') in interval)
+
+class TestParsing(unittest.TestCase):
+    def tearDown(self):
+        module.set_date_format(None)
+
+    def test_iso_date(self):
+        self.assertEqual(module.parse_iso8601('1996-01-12'), datetime(1996, 1, 12))
+
+    def test_iso_datetime(self):
+        self.assertEqual(module.parse_iso8601('2007-03-01T13:00:00.25'), datetime(2007, 3, 1, 13, 0, 0, 250000))
+
+    def test_not_iso(self):
+        self.failUnless(module.parse_iso8601('Jan 12 1996') is None)
+
+    def test_dateutil_fallback(self):
+        self.assertEqual(module.parse_date('Jan 12 1996'), datetime(1996, 1, 12))
+
+    def test_format(self):
+        self.assertEqual(module.parse_date('12/01/1996', '%d/%m/%Y'), datetime(1996, 1, 12))
+
+    def test_default_format(self):
+        module.set_date_format('%d/%m/%Y')
+        self.assertEqual(module.Instant('12/01/1996').datetime, datetime(1996, 1, 12))
+
+    def test_memoized(self):
+        module.parse_cache.clear()
+        module.parse_date('1996-01-12')
+        module.parse_date('1996-01-12')
+        self.assertEqual((module.parse_cache.hits, module.parse_cache.misses), (1, 1))
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = module.LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual([cache.get(key) for key in 'abc'], [1, None, 3])
+
+    def test_size_zero_stores_nothing(self):
+        cache = module.LRUCache(0)
+        cache.set('a', 1)
+        self.assertEqual(len(cache), 0)
+
+class TestTimestamps(unittest.TestCase):
+    def test_no_instance_dict(self):
+        self.failIf(hasattr(module.Instant('1996-01-01'), '__dict__'))
+        self.failIf(hasattr(module.Interval(('1996-01-01', '1996-01-03')), '__dict__'))
+
+    def test_datetime_view(self):
+        instant = module.Instant('2007-03-01T13:00:00.5')
+        self.assertEqual(instant.datetime, datetime(2007, 3, 1, 13, 0, 0, 500000))
+
+    def test_invertible(self):
+        t = datetime(2007, 3, 1, 13, 0, 0, 1)
+        self.assertEqual(module.timestamp_as_datetime(module.datetime_as_timestamp(t)), t)
+
+    def test_sentinels(self):
+        self.assertEqual(module.Instant('', BOT=True).datetime, module._BOT)
+        self.assertEqual(module.Instant('', EOT=True).datetime, module._EOT)
+
+    def test_copy_keeps_end_of_time(self):
+        self.failUnless(module.Instant(module.Instant('', EOT=True)).EOT)
+
+    def test_pickle(self):
+        interval = module.Interval(('', '1996-01-03'))
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            actual = pickle.loads(pickle.dumps(interval, protocol))
+            self.assertEqual(actual.timestamps, interval.timestamps)
+
+class TestOffset(unittest.TestCase):
+    def test_instant_offset(self):
+        self.assertEqual(module.Instant('1996-01-01').offset(timedelta(days=2)), module.Instant('1996-01-03'))
+
+    def test_open_interval_offset(self):
+        actual = module.Interval(('1996-01-01', '')).offset(timedelta(days=2))
+        self.assertEqual(actual, module.Interval(('1996-01-03', '')))
+
+@unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+class TestIntervalArray(unittest.TestCase):
+    def array(self):
+        return module.IntervalArray.from_intervals(as_intervals(ARRAY_SPELLS))
+
+    def test_zero_copy(self):
+        array = self.array()
+        self.failUnless(module.IntervalArray(array.beginning, array.end).beginning is array.beginning)
+
+    def test_element_is_interval(self):
+        for (desired, actual) in zip(as_intervals(ARRAY_SPELLS), self.array()):
+            self.failUnless(isinstance(actual, module.Interval))
+            self.assertEqual(desired.timestamps, actual.timestamps)
+
+    def test_slice_is_array(self):
+        self.assertEqual(len(self.array()[1:]), 3)
+
+    def test_intersects_interval(self):
+        other = module.Interval(('1996-01-04', '1996-01-07'))
+        desired = [interval.intersects(other) for interval in as_intervals(ARRAY_SPELLS)]
+        self.assertListEqual(list(self.array().intersects(other)), desired)
+
+    def test_intersects_instant(self):
+        other = module.Instant('1996-01-02')
+        desired = [interval.intersects(other) for interval in as_intervals(ARRAY_SPELLS)]
+        self.assertListEqual(list(self.array().intersects(other)), desired)
+
+    def test_contains(self):
+        other = module.Interval(('1996-01-02', '1996-01-03'))
+        desired = [interval.contains(other) for interval in as_intervals(ARRAY_SPELLS)]
+        self.assertListEqual(list(self.array().contains(other)), desired)
+
+    def test_intersects_array(self):
+        array = self.array()
+        self.assertListEqual(list(array.intersects(array)), [True, True, True, False])
+
+    def test_intersection(self):
+        other = module.Interval(('1996-01-02', '1996-01-10'))
+        actual = self.array().intersection(other)
+        for (interval, element) in zip(as_intervals(ARRAY_SPELLS), actual):
+            desired = interval.intersection(other)
+            if isinstance(desired, module.Interval):
+                self.assertEqual(desired, element)
+            else:
+                self.failUnless(element.is_empty)
+
+    def test_intersection_with_instant(self):
+        instant = module.Instant('1996-01-02')
+        actual = self.array().intersection(instant)
+        self.failUnless(actual.is_empty.all())
+        self.assertListEqual(list(actual.beginning == actual.end), [True, True, False, False])
+        self.assertListEqual(list(actual.beginning[:2]), [instant.timestamp] * 2)
+        self.failUnless(self.array().intersection(module.Instant(None, empty=True)).is_empty.all())
+
+    def test_length(self):
+        self.assertEqual(self.array().length[1], numpy.timedelta64(6, 'D'))
+        self.assertEqual(self.array().length[3], numpy.timedelta64(0, 'D'))
+
+    def test_offset_keeps_open_end(self):
+        actual = self.array().offset(timedelta(days=1))
+        self.assertEqual(actual[2], module.Interval(('1996-01-08', '')))
+
+class TestIntervalIndex(unittest.TestCase):
+    def test_overlap(self):
+        index = module.IntervalIndex(as_intervals(SPELLS))
+        for other in [module.Interval(('1996-01-04', '1996-01-07')), module.Interval(('1996-02-10', '1996-03-01')), module.Interval(('1995-07-01', '1995-12-01'))]:
+            actual = [interval.timestamps for interval in index.overlap(other)]
+            self.assertListEqual(actual, overlapping(as_intervals(SPELLS), other))
+
+    def test_stab(self):
+        index = module.IntervalIndex(as_intervals(SPELLS))
+        instant = module.Instant('1996-01-03')
+        actual = [interval.timestamps for interval in index.stab(instant)]
+        self.assertListEqual(actual, overlapping(as_intervals(SPELLS), instant))
+
+    def test_nearest(self):
+        intervals = as_intervals(SPELLS)
+        index = module.IntervalIndex(intervals)
+        for other in [module.Interval(('1996-01-15', '1996-01-20')), module.Interval(('1996-02-15', '1996-02-18')), module.Instant('1995-07-01'), module.Instant('1996-01-05')]:
+            (interval, distance) = index.nearest(other)
+            self.assertEqual(distance, min([item.distance(other) for item in intervals]))
+            self.assertEqual(interval.distance(other), distance)
+
+    def test_nearest_in_empty_index(self):
+        self.assertEqual(module.IntervalIndex().nearest(module.Instant('1996-01-01')), (None, None))
+
+    def test_insert_and_remove(self):
+        intervals = as_intervals(SPELLS)
+        index = module.IntervalIndex()
+        for interval in intervals:
+            index.insert(interval)
+        index.remove(module.Interval(('1996-01-02', '1996-01-08')))
+        index.remove(intervals[0])
+        self.assertEqual(len(index), len(intervals) - 2)
+        other = module.Interval(('1996-01-01', '1996-01-05'))
+        actual = [interval.timestamps for interval in index.overlap(other)]
+        self.assertListEqual(actual, overlapping(intervals[1:-1], other))
+
+    def test_remove_missing(self):
+        index = module.IntervalIndex(as_intervals(SPELLS))
+        self.assertRaises(ValueError, index.remove, module.Interval(('1997-01-01', '1997-01-02')))
+
+    def test_iterates_in_order(self):
+        index = module.IntervalIndex(as_intervals(SPELLS))
+        actual = [interval.timestamps for interval in index]
+        self.assertListEqual(actual, sorted([interval.timestamps for interval in as_intervals(SPELLS)]))
+
+    def test_many_random_inserts(self):
+        generator = random.Random(0)
+        intervals = []
+        index = module.IntervalIndex()
+        for _ in range(500):
+            b = generator.randrange(1000)
+            interval = module.Interval.from_timestamps(b, b + generator.randrange(1, 50))
+            intervals.append(interval)
+            index.insert(interval)
+        for interval in intervals[::3]:
+            index.remove(interval)
+        remaining = [interval for (position, interval) in enumerate(intervals) if position % 3]
+        other = module.Interval.from_timestamps(400, 420)
+        self.assertListEqual([interval.timestamps for interval in index.overlap(other)], overlapping(remaining, other))
+
+    @unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+    def test_from_array(self):
+        index = module.IntervalIndex.from_array(module.IntervalArray.from_intervals(as_intervals(SPELLS)))
+        self.assertEqual(len(index), len(as_intervals(SPELLS)))
+
+class TestTimeline(unittest.TestCase):
+    def assertSameAsRebuilt(self, timeline, intervals):
+        self.assertEqual(len(timeline), len(intervals))
+        self.assertEqual(timeline.union.timestamps, module.MultiInterval(intervals).timestamps)
+        self.assertEqual(timeline.length, module.MultiInterval(intervals).length)
+        self.assertEqual(timeline.coverage(), module.coverage_counts(intervals))
+
+    def test_seeded_from_multiinterval(self):
+        multiinterval = module.MultiInterval(as_intervals(SPELLS))
+        timeline = module.Timeline(multiinterval)
+        self.assertSameAsRebuilt(timeline, multiinterval.intervals)
+
+    def test_add_and_remove(self):
+        intervals = as_intervals(SPELLS)
+        timeline = module.Timeline()
+        for (index, interval) in enumerate(intervals):
+            timeline.add(interval)
+            self.assertSameAsRebuilt(timeline, intervals[:index+1])
+        timeline.remove(module.Interval(('1996-01-02', '1996-01-08')))
+        timeline.remove(intervals[0])
+        self.assertSameAsRebuilt(timeline, intervals[1:6])
+
+    def test_random_updates(self):
+        generator = random.Random(0)
+        timeline = module.Timeline()
+        intervals = []
+        for step in range(300):
+            if intervals and generator.random() < 0.4:
+                timeline.remove(intervals.pop(generator.randrange(len(intervals))))
+            else:
+                day = generator.randrange(60)
+                interval = module.Interval((datetime(2000, 1, 1) + timedelta(days=day), datetime(2000, 1, 1) + timedelta(days=day + generator.randrange(1, 10))))
+                intervals.append(interval)
+                timeline.add(interval)
+        self.assertSameAsRebuilt(timeline, intervals)
+        for day in range(0, 70, 3):
+            instant = module.Instant(datetime(2000, 1, 1) + timedelta(days=day))
+            desired = len([interval for interval in intervals if interval.timestamps[0] <= instant.timestamp < interval.timestamps[1]])
+            self.assertEqual(timeline.count_at(instant), desired)
+
+    def test_count_at(self):
+        timeline = module.Timeline(as_intervals(SPELLS))
+        self.assertEqual(timeline.count_at(module.Instant('1996-01-02')), 3)
+        self.assertEqual(timeline.count_at(module.Instant('1996-01-08')), 1)
+        self.assertEqual(timeline.count_at(module.Instant('1996-01-10')), 0)
+        self.assertEqual(timeline.count_at(module.Instant('1990-01-01')), 1)
+
+    def test_union_is_cached(self):
+        timeline = module.Timeline(as_intervals(SPELLS))
+        self.failUnless(timeline.union is timeline.union)
+        timeline.add(module.Interval(('1996-01-10', '1996-02-01')))
+        self.assertEqual(len(timeline.union.intervals), 3)
+
+    def test_remove_missing(self):
+        timeline = module.Timeline(as_intervals(SPELLS))
+        self.assertRaises(ValueError, timeline.remove, module.Interval(('1996-01-01', '1996-01-02')))
+        self.assertRaises(ValueError, timeline.remove, module.Interval(None, empty=True))
+
+    def test_empty(self):
+        timeline = module.Timeline()
+        self.assertEqual(timeline.length, timedelta(0))
+        self.failUnless(timeline.union.is_empty)
+        self.assertListEqual(timeline.coverage(), [])
+
+class TestPeriodTotals(unittest.TestCase):
+    def spells(self):
+        return [module.Interval(spell) for spell in [
+            ('1991-01-15', '1991-03-10'), ('1991-02-01', '1991-03-01'), ('1991-02-10', '1991-02-11'),
+            ('1991-06-01', '1992-02-01'), ('1991-01-01', '1991-01-01T12:00:00')]]
+
+    def brute_force(self, spells, periods):
+        output = []
+        for (label, beginning, end) in periods:
+            period = module.Interval((beginning, end))
+            overlaps = [spell.intersection(period).length for spell in spells if spell.intersection(period).length]
+            output.append((label, sum(overlaps, timedelta(0)), len(overlaps)))
+        return output
+
+    def test_months(self):
+        spells = self.spells()[:3]
+        actual = [(period, days, active) for (group, period, days, active, weighted) in module.period_totals(spells)]
+        periods = [('1991-01', '1991-01-01', '1991-02-01'), ('1991-02', '1991-02-01', '1991-03-01'), ('1991-03', '1991-03-01', '1991-04-01')]
+        desired = [(label, module.timedelta_as_x(days), active) for (label, days, active) in self.brute_force(spells, periods)]
+        self.assertListEqual(actual, desired)
+
+    def test_quarters_with_gap(self):
+        actual = [(period, days, active) for (group, period, days, active, weighted) in module.period_totals(self.spells()[3:4], 'quarter')]
+        self.assertListEqual(actual, [('1991Q2', 30.0, 1), ('1991Q3', 92.0, 1), ('1991Q4', 92.0, 1), ('1992Q1', 31.0, 1)])
+        actual = [period for (group, period, days, active, weighted) in module.period_totals(self.spells()[:4], 'year')]
+        self.assertListEqual(actual, ['1991', '1992'])
+
+    def test_partial_day(self):
+        actual = list(module.period_totals(self.spells()[4:], 'year'))
+        self.assertListEqual(actual, [(None, '1991', 0.5, 1, 0.5)])
+
+    def test_groups_and_weights(self):
+        items = [(1, 2.0, module.Interval(('1991-01-01', '1991-03-01'))), (2, 1.0, module.Interval(('1991-02-01', '1991-02-15'))),
+                 (1, 0.5, module.Interval(('1991-02-01', '1991-02-11')))]
+        actual = list(module.period_totals(items, key=lambda item: item[0], weight=lambda item: item[1], spell=lambda item: item[2]))
+        self.assertListEqual(actual, [(1, '1991-01', 31.0, 1, 62.0), (1, '1991-02', 38.0, 2, 61.0), (2, '1991-02', 14.0, 1, 14.0)])
+
+    def test_window(self):
+        spells = [module.Interval(('1990-06-01', '')), module.Interval(('', '1991-01-01'))]
+        actual = list(module.period_totals(spells, 'year', window=module.Interval(('1990-01-01', '1992-01-01'))))
+        self.assertListEqual(actual, [(None, '1990', 579.0, 2, 579.0), (None, '1991', 365.0, 1, 365.0)])
+
+    def test_open_ends_need_window(self):
+        spells = [module.Interval(('2000-01-01', '')), module.Interval(('2003-05-01', ''))]
+        self.assertRaises(ValueError, list, module.period_totals(spells, 'year'))
+        self.assertRaises(ValueError, list, module.period_totals([module.Interval(('', '2005-02-15'))]))
+        self.assertRaises(ValueError, list, module.period_totals(spells, 'year', window=module.Interval(('1999-01-01', ''))))
+        actual = [(period, active) for (group, period, days, active, weighted) in module.period_totals(spells, 'year', window=module.Interval(('', '2006-01-01')))]
+        self.assertListEqual(actual, [('2000', 1), ('2001', 1), ('2002', 1), ('2003', 2), ('2004', 2), ('2005', 2)])
+
+    def test_open_ends_outside_window(self):
+        spells = [module.Interval(('2010-01-01', '')), module.Interval(('2003-05-01', '2003-06-01'))]
+        actual = [period for (group, period, days, active, weighted) in module.period_totals(spells, 'year', window=module.Interval(('', '2005-01-01')))]
+        self.assertListEqual(actual, ['2003'])
+
+    def test_spell_ending_at_period_beginning(self):
+        actual = list(module.period_totals([module.Interval(('1991-01-01', '1991-02-01'))]))
+        self.assertListEqual(actual, [(None, '1991-01', 31.0, 1, 31.0)])
+
+    def test_unknown_frequency(self):
+        self.assertRaises(ValueError, list, module.period_totals(self.spells(), 'week'))
+
+class TestCoalesce(unittest.TestCase):
+    def items(self):
+        return [(1, module.Interval(('1991-01-01', '1991-01-31'))), (1, module.Interval(('1991-03-01', '1991-03-31'))),
+                (1, module.Interval(('1991-01-20', '1991-02-10'))), (1, module.Interval(('1991-02-11', '1991-02-20'))),
+                (2, module.Interval(('1991-01-01', '1991-01-31'))), (2, module.Interval(('1991-01-31', '1991-02-28'))),
+                (2, module.Interval(None, empty=True))]
+
+    def coalesce(self, items, tolerance):
+        return [(group, spell.timestamps, len(merged)) for (group, spell, merged) in
+                module.coalesce(items, tolerance, key=lambda item: item[0], spell=lambda item: item[1])]
+
+    def timestamps(self, beginning, end):
+        return module.Interval((beginning, end)).timestamps
+
+    def test_overlapping_and_touching(self):
+        desired = [(1, self.timestamps('1991-01-01', '1991-02-10'), 2), (1, self.timestamps('1991-02-11', '1991-02-20'), 1),
+                   (1, self.timestamps('1991-03-01', '1991-03-31'), 1), (2, self.timestamps('1991-01-01', '1991-02-28'), 2),
+                   (2, (None, None), 1)]
+        self.assertListEqual(self.coalesce(self.items(), timedelta(0)), desired)
+
+    def test_gap(self):
+        desired = [(1, self.timestamps('1991-01-01', '1991-02-20'), 3), (1, self.timestamps('1991-03-01', '1991-03-31'), 1),
+                   (2, self.timestamps('1991-01-01', '1991-02-28'), 2), (2, (None, None), 1)]
+        self.assertListEqual(self.coalesce(self.items(), timedelta(days=1)), desired)
+        self.assertEqual(len(self.coalesce(self.items(), timedelta(days=9))), 3)
+
+    def test_same_as_union(self):
+        intervals = [item[1] for item in self.items()]
+        actual = [spell.timestamps for (group, spell, merged) in module.coalesce(intervals) if not spell.is_empty]
+        self.assertListEqual(actual, module.MultiInterval(intervals).timestamps)
+
+    def test_empty_spells_pass_through(self):
+        items = [(1, module.Interval(('1991-01-01', '1991-01-01'))), (1, module.Interval(('1991-02-01', '1991-03-01'))),
+                 (1, module.Interval(('1991-03-01', '1991-03-31'))), (1, module.Interval(('1991-05-01', '1991-04-01'))),
+                 (2, module.Interval(('1992-03-01', '1992-01-01')))]
+        actual = list(module.coalesce(items, key=lambda item: item[0], spell=lambda item: item[1]))
+        self.assertEqual(sum([len(merged) for (group, spell, merged) in actual]), len(items))
+        self.assertListEqual([(group, merged) for (group, spell, merged) in actual if spell.is_empty], [(1, [items[0]]), (1, [items[3]]), (2, [items[4]])])
+
+    def test_unsorted_keys(self):
+        items = self.items()
+        self.assertRaises(ValueError, self.coalesce, items + items[:1], timedelta(0))
+        unchecked = module.coalesce(items + items[:1], key=lambda item: item[0], spell=lambda item: item[1], check=False)
+        self.assertListEqual([group for (group, spell, merged) in unchecked], [1, 1, 1, 2, 2, 1])
+
+class TestValueSemantics(unittest.TestCase):
+    def test_hash_and_equality(self):
+        a = module.Interval(('1996-01-01', '1996-01-03'))
+        b = module.Interval(('1996-01-01', '1996-01-03'))
+        self.assertEqual(a, b)
+        self.failIf(a != b)
+        self.assertEqual(hash(a), hash(b))
+        self.assertEqual(len(set([a, b, module.Interval(('1996-01-01', '1996-01-04'))])), 2)
+        self.assertEqual({a: 1}[b], 1)
+
+    def test_equal_across_classes(self):
+        interval = module.Interval(('1996-01-01', '1996-01-03'))
+        multiinterval = module.MultiInterval([interval])
+        self.assertEqual(interval, multiinterval)
+        self.assertEqual(hash(interval), hash(multiinterval))
+        instant = module.Instant('1996-01-01')
+        self.assertEqual(instant, module.MultiInstant([instant]))
+        self.assertNotEqual(instant, interval)
+        self.assertEqual(module.Instant(None, empty=True), module.Interval(None, empty=True))
+
+    def test_no_geometry(self):
+        module.shape_cache.clear()
+        a = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-02-01', '1996-02-03'))])
+        previous = module.use_backend('shapely')
+        try:
+            self.assertEqual(a, module.MultiInterval(a.intervals))
+        finally:
+            module.use_backend(previous)
+        self.assertEqual(module.shape_cache.info()['misses'], 0)
+
+    def test_not_equal_to_other_types(self):
+        self.assertNotEqual(module.Instant('1996-01-01'), '1996-01-01')
+        self.failIf(module.Interval(('1996-01-01', '1996-01-03')) == None)
+
+    def test_total_order(self):
+        intervals = [module.Interval(spell) for spell in [('1996-01-02', '1996-01-03'), ('1996-01-01', '1996-01-05'),
+                                                          ('1996-01-01', '1996-01-02'), ('', '1995-01-01')]]
+        actual = sorted(intervals)
+        self.assertListEqual([interval.timestamps for interval in actual], sorted([interval.timestamps for interval in intervals]))
+        position = bisect.bisect_left(actual, module.Interval(('1996-01-01', '1996-01-03')))
+        self.assertEqual(position, 2)
+        instants = [module.Instant('1996-01-03'), module.Instant('1996-01-01'), module.Instant('1996-01-02')]
+        self.assertListEqual(sorted(instants), [instants[1], instants[2], instants[0]])
+
+    def test_comparisons_agree(self):
+        a = module.Interval(('1996-01-01', '1996-01-05'))
+        b = module.Interval(('1996-01-03', '1996-01-09'))
+        empty = module.Interval(None, empty=True)
+        for (x, y) in [(a, b), (b, a), (a, a), (empty, a), (a, empty), (empty, empty), (a, module.Instant('1996-01-01'))]:
+            self.assertEqual(x <= y, x < y or x == y)
+            self.assertEqual(x >= y, x > y or x == y)
+            self.assertEqual(x < y, y > x)
+            self.assertEqual(x <= y, y >= x)
+            self.assertEqual(len([True for relation in (x < y, x == y, x > y) if relation]), 1)
+
+    def test_precedes_and_follows(self):
+        a = module.Interval(('1996-01-01', '1996-01-05'))
+        b = module.Interval(('1996-01-03', '1996-01-09'))
+        c = module.Interval(('1996-01-05', '1996-01-09'))
+        empty = module.Interval(None, empty=True)
+        self.failIf(a.precedes(b))
+        self.failUnless(a.precedes(c))
+        self.failUnless(c.follows(a))
+        self.failIf(b.follows(a))
+        self.failUnless(module.Instant('1996-01-01').precedes(a))
+        self.failIf(empty.precedes(a) or a.precedes(empty) or empty.follows(a))
+
+    def test_intern(self):
+        table = module.InternTable()
+        a = table.intern(module.Interval(('1996-01-01', '1996-01-03')))
+        b = table.intern(module.Interval(('1996-01-01', '1996-01-03')))
+        c = table.intern(module.MultiInterval([a]))
+        self.failUnless(a is b)
+        self.failIf(c is a)
+        self.assertEqual(len(table), 2)
+
+    def test_pickled_hash(self):
+        interval = module.Interval(('1996-01-01', '1996-01-03'))
+        self.assertEqual(hash(pickle.loads(pickle.dumps(interval))), hash(interval))
+        instant = module.Instant('1996-01-01')
+        self.assertEqual(pickle.loads(pickle.dumps(instant)), instant)
+
+class TestLazyLoading(unittest.TestCase):
+    def loaded_modules(self, code):
+        child = 'import sys; %s; sys.stdout.write(",".join(sorted(set([name.split(".")[0] for name in sys.modules]) & set(["shapely", "dateutil", "numpy"]))))' % code
+        process = subprocess.Popen([sys.executable, '-c', child], stdout=subprocess.PIPE, cwd=os.path.dirname(os.path.abspath(__file__)))
+        (stdout, _) = process.communicate()
+        return [name for name in stdout.decode('ascii').split(',') if name]
+
+    def test_import_loads_no_optional_modules(self):
+        self.assertListEqual(self.loaded_modules('import timely'), [])
+
+    def test_native_operations_on_iso_dates(self):
+        code = 'import timely; a = timely.Interval(("1996-01-01", "1996-01-03")); (a - timely.Interval(("1996-01-02", ""))).length'
+        self.assertListEqual(self.loaded_modules(code), [])
+
+    def test_loaded_when_needed(self):
+        self.failUnless('shapely' in self.loaded_modules('import timely; timely.use_backend("shapely")'))
+        self.assertListEqual(self.loaded_modules('import timely; timely.Instant("January 1, 1996")'), ['dateutil'])
+
+    def test_register_backend_by_path(self):
+        module.register_backend('native by path', 'timely.NativeBackend')
+        try:
+            previous = module.use_backend('native by path')
+            self.assertEqual(module.backend.name, 'native')
+            module.use_backend(previous)
+        finally:
+            del module.BACKENDS['native by path']
+
+class TestCoverageCounts(unittest.TestCase):
+    def intervals(self):
+        return [module.Interval(('1996-01-01', '1996-01-10')),
+                module.Interval(('1996-01-05', '1996-01-15')),
+                module.Interval(('1996-01-10', '1996-01-12')),
+                module.Interval(('1996-01-20', '1996-01-25'))]
+
+    def as_strings(self, counts):
+        return [(unicode(segment), count) for (segment, count) in counts]
+
+    def test_step_function(self):
+        actual = self.as_strings(module.coverage_counts(self.intervals()))
+        desired = [(u'1996-01-01T00:00:00/1996-01-05T00:00:00', 1),
+                   (u'1996-01-05T00:00:00/1996-01-12T00:00:00', 2),
+                   (u'1996-01-12T00:00:00/1996-01-15T00:00:00', 1),
+                   (u'1996-01-15T00:00:00/1996-01-20T00:00:00', 0),
+                   (u'1996-01-20T00:00:00/1996-01-25T00:00:00', 1)]
+        self.assertListEqual(actual, desired)
+
+    def test_same_as_counting_intersections(self):
+        intervals = self.intervals()
+        for (segment, count) in module.coverage_counts(intervals):
+            middle = module.Instant(segment.beginning.datetime + (segment.end.datetime - segment.beginning.datetime) // 2)
+            self.assertEqual(count, sum([1 for interval in intervals if interval.contains(middle)]))
+
+    def test_empty(self):
+        self.assertListEqual(module.coverage_counts([]), [])
+
+    def test_by_key(self):
+        items = [('a', interval) for interval in self.intervals()[:2]] + [('b', self.intervals()[3])]
+        actual = module.coverage_counts(items, key=lambda item: item[0], spell=lambda item: item[1])
+        self.assertListEqual(sorted(actual.keys()), ['a', 'b'])
+        self.assertListEqual([count for (segment, count) in actual['a']], [1, 2, 1])
+        self.assertListEqual(self.as_strings(actual['b']), [(u'1996-01-20T00:00:00/1996-01-25T00:00:00', 1)])
+
+    def test_envelope(self):
+        actual = module.MultiInterval(self.intervals()).envelope
+        self.assertEqual(actual, module.Interval(('1996-01-01', '1996-01-25')))
+
+class TestSubDay(unittest.TestCase):
+    def test_intraday_intersection(self):
+        interval1 = module.Interval(('1996-01-01T08:00:00', '1996-01-01T16:30:00'))
+        interval2 = module.Interval(('1996-01-01T12:00:00.000001', '1996-01-02'))
+        actual = interval1.intersection(interval2)
+        self.assertEqual(unicode(actual), u'1996-01-01T12:00:00.000001/1996-01-01T16:30:00')
+        self.assertEqual(actual.length, timedelta(hours=4, minutes=30, microseconds=-1))
+
+    def test_intraday_distance(self):
+        interval1 = module.Interval(('1996-01-01T08:00:00', '1996-01-01T16:00:00'))
+        interval2 = module.Interval(('1996-01-01T16:00:01', '1996-01-02'))
+        self.assertEqual(interval1.distance(interval2), timedelta(seconds=1))
+
+    def test_exact_at_end_of_time(self):
+        interval = module.Interval(('9999-12-30T23:59:59.999998', ''))
+        self.assertEqual(interval.length, timedelta(microseconds=2))
+
+    def test_shapely_keeps_hours(self):
+        # float days are only exact to some microseconds
+        interval1 = module.Interval(('1996-01-01T08:00:00', '1996-01-01T16:00:00'))
+        interval2 = module.Interval(('1996-01-01T12:00:00', '1996-01-02'))
+        desired = interval1.intersection(interval2)
+        actual = module.ShapelyBackend().intersection(interval1, interval2)
+        for (d, a) in zip(desired.timestamps, actual.timestamps):
+            self.assertAlmostEqual(d, a, delta=50)
+
+class TestShapeCache(unittest.TestCase):
+    def setUp(self):
+        module.shape_cache.clear()
+
+    def tearDown(self):
+        module.shape_cache.size = module.SHAPE_CACHE_SIZE
+        module.shape_cache.clear()
+
+    def test_repeated_operand_is_converted_once(self):
+        mi = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-07', '1996-01-08'))])
+        backend = module.ShapelyBackend()
+        for day in ['1996-01-02', '1996-01-04', '1996-01-05']:
+            backend.intersects(mi, module.Instant(day))
+        self.assertEqual(module.shape_cache.misses, 4)
+        self.assertEqual(module.shape_cache.hits, 2)
+
+    def test_equal_endpoints_share_shape(self):
+        interval1 = module.Interval(('1996-01-01', '1996-01-03'))
+        interval2 = module.Interval(('1996-01-01', '1996-01-03'))
+        self.failUnless(module.cached_shape(interval1) is module.cached_shape(interval2))
+        self.assertEqual(module.shape_cache.info()['hits'], 1)
+
+    def test_cache_off(self):
+        module.shape_cache.size = 0
+        interval = module.Interval(('1996-01-01', '1996-01-03'))
+        module.cached_shape(interval)
+        module.cached_shape(interval)
+        self.assertEqual(module.shape_cache.info(), dict(hits=0, misses=2, size=0, maxsize=0))
+
+    def test_same_geometry(self):
+        mi = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-07', '1996-01-08'))])
+        self.failUnless(module.cached_shape(mi).equals(module.time_as_shape(mi)))
+
+class TestBatch(unittest.TestCase):
+    def right(self):
+        return [module.Interval(('1996-01-03', '1996-01-05')),
+                module.Interval(('1996-01-03', '1996-01-05')),
+                module.Interval(('1996-01-01', '1996-01-02')),
+                module.Interval(('1996-01-01', '1996-01-02'))]
+
+    def test_intersects_many(self):
+        desired = [a.intersects(b) for (a, b) in zip(as_intervals(ARRAY_SPELLS), self.right())]
+        self.assertListEqual(module.intersects_many(as_intervals(ARRAY_SPELLS), self.right()), desired)
+
+    def test_broadcast(self):
+        other = module.Interval(('1996-01-04', '1996-01-07'))
+        desired = [a.intersects(other) for a in as_intervals(ARRAY_SPELLS)]
+        self.assertListEqual(module.intersects_many(as_intervals(ARRAY_SPELLS), other), desired)
+        self.assertListEqual(module.intersects_many(other, as_intervals(ARRAY_SPELLS)), desired)
+
+    def test_intersection_many(self):
+        for (a, b, actual) in zip(as_intervals(ARRAY_SPELLS), self.right(), module.intersection_many(as_intervals(ARRAY_SPELLS), self.right())):
+            desired = a.intersection(b)
+            self.assertEqual(type(desired), type(actual))
+            self.assertEqual(unicode(desired), unicode(actual))
+
+    def test_difference_many(self):
+        for (a, b, actual) in zip(as_intervals(ARRAY_SPELLS), self.right(), module.difference_many(as_intervals(ARRAY_SPELLS), self.right())):
+            desired = a.difference(b)
+            self.assertEqual(unicode(desired), unicode(actual))
+
+    def test_different_lengths(self):
+        self.assertRaises(ValueError, module.intersects_many, as_intervals(ARRAY_SPELLS), self.right()[1:])
+
+    @unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+    def test_arrays(self):
+        left = module.IntervalArray.from_intervals(as_intervals(ARRAY_SPELLS))
+        desired = [a.intersects(b) for (a, b) in zip(as_intervals(ARRAY_SPELLS), self.right())]
+        self.assertListEqual(list(module.intersects_many(left, self.right())), desired)
+        other = module.Interval(('1996-01-04', '1996-01-07'))
+        actual = module.intersection_many(other, left)
+        self.assertEqual(actual[1], module.Interval(('1996-01-04', '1996-01-07')))
+
+    @unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+    def test_arrays_and_instant(self):
+        left = module.IntervalArray.from_intervals(as_intervals(ARRAY_SPELLS))
+        instant = module.Instant('1996-01-02')
+        desired = [a.intersects(instant) for a in as_intervals(ARRAY_SPELLS)]
+        self.assertListEqual(list(module.intersects_many(left, instant)), desired)
+        self.assertListEqual(list(module.intersects_many(instant, left)), desired)
+        self.assertListEqual(module.intersects_many(as_intervals(ARRAY_SPELLS), instant), desired)
+        self.assertListEqual(module.intersection_many(instant, left), module.intersection_many(instant, as_intervals(ARRAY_SPELLS)))
+        self.assertListEqual(module.difference_many(left, instant), module.difference_many(as_intervals(ARRAY_SPELLS), instant))
+        self.assertListEqual(module.difference_many(instant, left), module.difference_many(instant, as_intervals(ARRAY_SPELLS)))
+
+    @unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+    def test_same_for_arrays_and_lists(self):
+        left = module.IntervalArray.from_intervals(as_intervals(ARRAY_SPELLS))
+        for right in [self.right(), module.IntervalArray.from_intervals(self.right()), module.Interval(('1996-01-03', '1996-01-07'))]:
+            for function in [module.intersection_many, module.difference_many]:
+                desired = function(as_intervals(ARRAY_SPELLS), right)
+                actual = function(left, right)
+                self.assertListEqual([type(item) for item in actual], [type(item) for item in desired])
+                self.assertListEqual(actual, desired)
+
+    @unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+    def test_touching_arrays(self):
+        left = module.IntervalArray.from_intervals([module.Interval(('1996-01-01', '1996-01-03'))])
+        right = module.IntervalArray.from_intervals([module.Interval(('1996-01-03', '1996-01-05'))])
+        self.assertListEqual(list(module.intersects_many(left, right)), [True])
+        self.assertListEqual(module.intersection_many(left, right), [module.Instant('1996-01-03')])
+        actual = left.intersection(right)
+        self.assertEqual((actual.beginning[0], actual.end[0]), (module.Instant('1996-01-03').timestamp,) * 2)
+
+    @unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+    def test_array_difference(self):
+        left = module.IntervalArray.from_intervals(as_intervals(ARRAY_SPELLS))
+        (before, after) = left.difference(module.IntervalArray.from_intervals(self.right()))
+        for (a, b, x, y) in zip(as_intervals(ARRAY_SPELLS), self.right(), before, after):
+            desired = a.difference(b)
+            actual = module.MultiInterval([x, y])
+            self.assertEqual(desired.length, actual.length)
+            if not desired.is_empty:
+                self.assertEqual(desired, actual)
+
+class TestOverlapJoin(unittest.TestCase):
+    def workers(self):
+        return [('A', module.Interval(('1996-01-01', '1996-01-10'))),
+                ('A', module.Interval(('1996-01-05', '1996-01-20'))),
+                ('A', module.Interval(('1996-02-01', ''))),
+                ('B', module.Interval(('1996-01-01', '1996-01-10')))]
+
+    def periods(self):
+        return [('A', module.Interval(('1996-01-01', '1996-01-08'))),
+                ('A', module.Interval(('1996-01-08', '1996-01-15'))),
+                ('A', module.Interval(('1996-01-15', '1996-02-01'))),
+                ('C', module.Interval(('1996-01-01', '1996-01-10')))]
+
+    def join(self, left, right):
+        actual = module.overlap_join(left, right, key=lambda item: item[0], spell=lambda item: item[1])
+        (left_index, right_index) = (dict((id(item), i) for (i, item) in enumerate(left)), dict((id(item), j) for (j, item) in enumerate(right)))
+        return sorted([(left_index[id(a)], right_index[id(b)], unicode(c)) for (a, b, c) in actual])
+
+    def test_same_as_nested_loops(self):
+        (left, right) = (self.workers(), self.periods())
+        desired = sorted([(i, j, unicode(a[1].intersection(b[1]))) for (i, a) in enumerate(left) for (j, b) in enumerate(right) if a[0] == b[0] and a[1].intersects(b[1])])
+        self.assertListEqual(self.join(left, right), desired)
+
+    def test_touching_intervals_meet_in_instant(self):
+        actual = self.join(self.workers(), self.periods())
+        self.failUnless((2, 2, u'1996-02-01T00:00:00') in actual)
+
+    def test_is_lazy(self):
+        pairs = module.overlap_join([module.Interval(('1996-01-01', '1996-01-10'))], [module.Interval(('1996-01-05', '1996-01-20'))])
+        (a, b, c) = next(pairs)
+        self.assertEqual(c, module.Interval(('1996-01-05', '1996-01-10')))
+
+    def test_random_against_nested_loops(self):
+        generator = random.Random(1)
+        def spells(n):
+            output = []
+            for _ in range(n):
+                b = generator.randrange(100)
+                output.append((generator.randrange(3), module.Interval.from_timestamps(b, b + generator.randrange(0, 20))))
+            return output
+        (left, right) = (spells(60), spells(60))
+        desired = sorted([(i, j, unicode(a[1].intersection(b[1]))) for (i, a) in enumerate(left) for (j, b) in enumerate(right) if a[0] == b[0] and a[1].intersects(b[1])])
+        self.assertListEqual(self.join(left, right), desired)
+
+class TestProfiling(unittest.TestCase):
+    def tearDown(self):
+        module.disable_profiling()
+
+    def test_off_by_default(self):
+        self.failUnless(module.profiler is None)
+        self.failIf(hasattr(module.parse_date, 'profiled'))
+
+    def test_counts_stages(self):
+        with module.profiling() as profiler:
+            module.parse_cache.clear()
+            interval = module.Interval(('1996-01-01', '1996-01-03'))
+            module.ShapelyBackend().union(interval, module.Interval(('1996-01-02', '1996-01-08')))
+            interval.union(interval)
+        summary = profiler.summary()
+        self.assertEqual(summary['parse']['calls'], 4)
+        self.assertEqual(summary['geos']['calls'], 1)
+        self.assertEqual(summary['shape_as_time']['calls'], 1)
+        self.assertEqual(summary['native union']['calls'], 1)
+        self.assertEqual(sum(summary['parse']['histogram'].values()), 4)
+
+    def test_nested_stages_counted_once(self):
+        a = module.MultiInterval([module.Interval(('1996-01-01', '1996-01-03')), module.Interval(('1996-01-05', '1996-01-08')), module.Interval(('1996-01-10', '1996-01-12'))])
+        b = module.Interval(('1996-01-02', '1996-01-11'))
+        previous = module.use_backend('shapely')
+        try:
+            with module.profiling() as profiler:
+                start = module.default_timer()
+                for _ in range(10):
+                    self.assertEqual(len(a.intersection(b).intervals), 3)
+                total = module.default_timer()-start
+        finally:
+            module.use_backend(previous)
+        summary = profiler.summary()
+        self.assertEqual(summary['shape_as_time']['calls'], 10)
+        self.assertEqual(summary['linemerge']['calls'], 10)
+        self.assertEqual(summary['geos']['calls'], 10)
+        self.failUnless(sum([stage['seconds'] for stage in summary.values()]) <= total)
+
+    def test_recursive_stage_counted_once(self):
+        countdown = module._profiled('countdown', lambda n: n and countdown(n - 1))
+        with module.profiling() as profiler:
+            countdown(5)
+        self.assertEqual(profiler.summary()['countdown']['calls'], 1)
+
+    def test_restores_functions(self):
+        with module.profiling():
+            self.failUnless(hasattr(module.parse_date, 'profiled'))
+        self.failUnless(module.profiler is None)
+        self.failIf(hasattr(module.parse_date, 'profiled'))
+
+    def test_merge(self):
+        profiler = module.Profiler()
+        profiler.record('parse', 2e-6)
+        other = module.Profiler()
+        other.record('parse', 2e-3)
+        profiler.merge(other.summary())
+        self.assertEqual(profiler.summary()['parse']['calls'], 2)
+        self.assertEqual(profiler.summary()['parse']['histogram']['<10us'], 1)
+        self.assertEqual(profiler.summary()['parse']['histogram']['<10ms'], 1)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
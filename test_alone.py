@@ -1,6 +1,15 @@
 import alone as module
+import os
 import unittest
 
+def sorted_rows():
+    return [dict(id=1, start_date='1991-01-01', end_date='1991-01-31'),
+            dict(id=1, start_date='1991-01-15', end_date='1991-02-28'),
+            dict(id=2, start_date='1991-01-01', end_date='1991-12-31'),
+            dict(id=3, start_date='1991-01-01', end_date='1991-01-15'),
+            dict(id=3, start_date='1991-01-10', end_date='1991-01-31'),
+            dict(id=4, start_date='1991-01-01', end_date='1991-01-15')]
+
 class TestTagSpells(unittest.TestCase):
     def tag_spells(self, rows):
     	data = module.read_as_dict_of_groups(rows, group_keys=('id',))
@@ -51,5 +60,93 @@ class TestTagSpells(unittest.TestCase):
         desired[1]['days_alone'] = 364
         self.assertListEqual(actual, desired)
 
+class TestDaysAloneInGroup(unittest.TestCase):
+    def intervals(self):
+        return [module.Interval(spell) for spell in [
+            ('1991-01-01', '1991-01-15'), ('1991-01-10', '1991-01-31'), ('1991-01-05', '1991-01-20'),
+            ('1991-03-01', '1991-04-01'), ('1991-03-01', '1991-04-01'), ('1991-03-15', '1991-05-01'),
+            ('1991-06-01', '1991-06-10'), ('1991-06-10', '1991-06-20'), ('1991-07-01', '1991-06-01')]]
+
+    def test_same_as_days_alone(self):
+        list_of_intervals = self.intervals()
+        desired = [module.days_alone(interval, list_of_intervals) for interval in list_of_intervals]
+        actual = module.days_alone_in_group(list_of_intervals)
+        self.assertListEqual(desired, actual)
+
+    def test_touching_spells_are_alone(self):
+        list_of_intervals = self.intervals()[6:8]
+        self.assertListEqual(module.days_alone_in_group(list_of_intervals), [9, 10])
+
+    def test_empty_group(self):
+        self.assertListEqual(module.days_alone_in_group([]), [])
+
+class TestSortedGroups(unittest.TestCase):
+    def test_same_as_dict_of_groups(self):
+        desired = list(module.tag_spells(module.read_as_dict_of_groups(sorted_rows(), group_keys=('id',))))
+        actual = list(module.tag_groups(module.read_as_sorted_groups(sorted_rows(), group_keys=('id',))))
+        key = lambda row: (row['id'], row['start_date'])
+        self.assertListEqual(sorted(desired, key=key), sorted(actual, key=key))
+
+    def test_keeps_input_order(self):
+        actual = list(module.tag_groups(module.read_as_sorted_groups(sorted_rows(), group_keys=('id',))))
+        self.assertListEqual([row['id'] for row in actual], [1, 1, 2, 3, 3, 4])
+
+    def test_groups_are_lazy(self):
+        groups = module.read_as_sorted_groups(iter(sorted_rows()), group_keys=('id',))
+        (key, rows) = next(groups)
+        self.assertEqual(key, (1,))
+        self.assertEqual(len(rows), 2)
+
+    def test_unsorted_input_raises(self):
+        rows = sorted_rows()
+        rows.append(dict(id=1, start_date='1992-01-01', end_date='1992-01-31'))
+        groups = module.read_as_sorted_groups(rows, group_keys=('id',))
+        self.assertRaises(ValueError, list, groups)
+
+    def test_unchecked(self):
+        rows = sorted_rows()
+        rows.append(dict(id=1, start_date='1992-01-01', end_date='1992-01-31'))
+        groups = module.read_as_sorted_groups(rows, group_keys=('id',), check=False)
+        self.assertListEqual([key for (key, rows) in groups], [(1,), (2,), (3,), (4,), (1,)])
+
+class TestParallel(unittest.TestCase):
+    def test_batches_keep_groups_whole(self):
+        groups = module.read_as_sorted_groups(sorted_rows(), group_keys=('id',), parse=False)
+        actual = [[len(rows) for rows in batch] for batch in module.batches(groups, batch_size=2)]
+        self.assertListEqual(actual, [[2], [1, 2], [1]])
+
+    def test_same_as_serial(self):
+        desired = list(module.tag_groups(module.read_as_sorted_groups(sorted_rows(), group_keys=('id',))))
+        groups = module.read_as_sorted_groups(sorted_rows(), group_keys=('id',), parse=False)
+        actual = list(module.tag_in_parallel(groups, jobs=2, batch_size=2))
+        self.assertListEqual(desired, actual)
+
+    def test_profile_of_workers(self):
+        groups = module.read_as_sorted_groups(sorted_rows(), group_keys=('id',), parse=False)
+        with module.timely.profiling() as profiler:
+            module.timely.parse_cache.clear()
+            list(module.tag_in_parallel(groups, jobs=2, batch_size=2))
+        self.assertEqual(profiler.summary()['parse']['calls'], 2 * len(sorted_rows()))
+
+    def test_unparsed_dict_of_groups(self):
+        data = module.read_as_dict_of_groups(sorted_rows(), group_keys=('id',), parse=False)
+        self.failIf('_spell' in data[(1,)][0])
+
+class TestArguments(unittest.TestCase):
+    def test_binary_rejects_sorted_and_jobs(self):
+        self.assertEqual(module.parse_arguments(['--binary', 'spells.bin']).binary, 'spells.bin')
+        stderr = module.sys.stderr
+        module.sys.stderr = open(os.devnull, 'w')
+        try:
+            self.assertRaises(SystemExit, module.parse_arguments, ['--binary', 'spells.bin', '--sorted'])
+            self.assertRaises(SystemExit, module.parse_arguments, ['--binary', 'spells.bin', '--jobs', '4'])
+        finally:
+            module.sys.stderr.close()
+            module.sys.stderr = stderr
+
+    def test_no_check(self):
+        self.assertTrue(module.parse_arguments(['--sorted']).check)
+        self.assertFalse(module.parse_arguments(['--sorted', '--no-check']).check)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+import coalesce as module
+import unittest
+from datetime import timedelta
+
+class TestCoalesceRows(unittest.TestCase):
+    def rows(self):
+        return [dict(id='1', start_date='1991-01-01', end_date='1991-01-31', wage='10', firm='a'),
+                dict(id='1', start_date='1991-02-01', end_date='', wage='20', firm='b'),
+                dict(id='1', start_date='1991-01-15', end_date='1991-01-20', wage='5', firm='c'),
+                dict(id='2', start_date='1991-01-01', end_date='1991-01-31', wage='1.5', firm='a')]
+
+    def test_carry_first(self):
+        actual = list(module.coalesce_rows(self.rows(), timedelta(days=1), group_keys=('id',)))
+        self.assertListEqual(actual, [dict(id='1', start_date='1991-01-01', end_date='', wage='10', firm='a'),
+                                      dict(id='2', start_date='1991-01-01', end_date='1991-01-31', wage='1.5', firm='a')])
+
+    def test_aggregate(self):
+        aggregates = dict(wage='sum', firm='last', records='count')
+        actual = list(module.coalesce_rows(self.rows(), group_keys=('id',), aggregates=aggregates))
+        self.assertListEqual(actual, [dict(id='1', start_date='1991-01-01', end_date='1991-01-31', wage=15, firm='c', records=2),
+                                      dict(id='1', start_date='1991-02-01', end_date='', wage=20, firm='b', records=1),
+                                      dict(id='2', start_date='1991-01-01', end_date='1991-01-31', wage=1.5, firm='a', records=1)])
+
+    def test_empty_spells_are_kept(self):
+        rows = [dict(id='1', start_date='2005-01-01', end_date='2005-01-01'),
+                dict(id='1', start_date='2005-02-01', end_date='2005-03-01'),
+                dict(id='2', start_date='2006-03-01', end_date='2006-01-01')]
+        actual = list(module.coalesce_rows(rows, group_keys=('id',), aggregates=dict(records='count')))
+        self.assertEqual(len(actual), 3)
+        self.assertListEqual([(row['id'], row['start_date'], row['records']) for row in actual], [('1', '2005-02-01', 1), ('1', '2005-01-01', 1), ('2', '2006-03-01', 1)])
+
+    def test_parse_aggregate(self):
+        self.assertEqual(module.parse_aggregate('wage=max'), ('wage', 'max'))
+        self.assertRaises(module.argparse.ArgumentTypeError, module.parse_aggregate, 'wage')
+        self.assertRaises(module.argparse.ArgumentTypeError, module.parse_aggregate, 'wage=median')
+
+    def test_unchecked(self):
+        rows = [dict(id='1', start_date='1991-01-01', end_date='1991-01-31'),
+                dict(id='2', start_date='1991-01-01', end_date='1991-01-31'),
+                dict(id='1', start_date='1991-02-01', end_date='1991-02-28')]
+        self.assertRaises(ValueError, list, module.coalesce_rows(rows, group_keys=('id',)))
+        actual = list(module.coalesce_rows(rows, group_keys=('id',), check=False))
+        self.assertListEqual([row['id'] for row in actual], ['1', '2', '1'])
+        self.assertFalse(module.parse_arguments(['--no-check']).check)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import panel as module
+import unittest
+
+class TestPanel(unittest.TestCase):
+    def rows(self):
+        return [dict(id='1', start_date='1991-01-15', end_date='1991-02-15', wage='2'),
+                dict(id='1', start_date='1991-02-01', end_date='1991-03-01', wage='1'),
+                dict(id='2', start_date='1991-01-01', end_date='1992-01-01', wage='3')]
+
+    def test_panel_rows(self):
+        actual = list(module.panel_rows(self.rows(), 'quarter', group_keys=('id',), weight='wage'))
+        self.assertListEqual(actual, [dict(id='1', period='1991Q1', days=59.0, active=2, weighted=90.0),
+                                      dict(id='2', period='1991Q1', days=90.0, active=1, weighted=270.0),
+                                      dict(id='2', period='1991Q2', days=91.0, active=1, weighted=273.0),
+                                      dict(id='2', period='1991Q3', days=92.0, active=1, weighted=276.0),
+                                      dict(id='2', period='1991Q4', days=92.0, active=1, weighted=276.0)])
+
+    def test_sorted_same_as_unsorted(self):
+        desired = list(module.panel_rows(self.rows(), group_keys=('id',)))
+        actual = list(module.sorted_panel_rows(self.rows(), group_keys=('id',)))
+        self.assertListEqual(actual, desired)
+        self.failIf('weighted' in actual[0])
+
+    def test_open_spell(self):
+        rows = [dict(id='1', start_date='2005-01-01', end_date=''), dict(id='1', start_date='2005-02-01', end_date='2005-06-01')]
+        self.assertRaises(ValueError, list, module.panel_rows(rows, 'quarter', group_keys=('id',)))
+        window = module.Interval(('', '2005-07-01'))
+        actual = list(module.panel_rows(rows, 'quarter', group_keys=('id',), window=window))
+        self.assertListEqual(actual, [dict(id='1', period='2005Q1', days=149.0, active=2), dict(id='1', period='2005Q2', days=152.0, active=2)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import spellfile as module
+import alone
+import os
+import shutil
+import tempfile
+import unittest
+from timely import Interval
+
+@unittest.skipIf(module.numpy is None, 'NumPy is not installed')
+class TestSpellFile(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'spells.bin')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def rows(self):
+        return [dict(id='1', start_date='1991-01-01', end_date='1991-01-31'),
+                dict(id='2', start_date='1991-01-01', end_date='1991-12-31'),
+                dict(id='1', start_date='1991-01-15', end_date='1991-02-28'),
+                dict(id='3', start_date='1991-01-10', end_date=''),
+                dict(id='3', start_date='1991-01-01T12:30:00', end_date='1991-01-01')]
+
+    def test_csv_roundtrip(self):
+        self.assertEqual(module.csv_to_binary(self.rows(), self.path, group_keys=('id',)), 5)
+        actual = list(module.binary_to_rows(module.load(self.path)))
+        self.assertListEqual(actual, self.rows())
+
+    def test_non_ascii_keys(self):
+        rows = [{'m\xfbhely': 'M\xfbhely', 'start_date': '1991-01-01', 'end_date': '1991-01-31'},
+                {'m\xfbhely': 'M\xc5\xb1hely', 'start_date': '1991-01-01', 'end_date': ''}]
+        module.csv_to_binary(rows, self.path, group_keys=('m\xfbhely',))
+        spells = module.load(self.path)
+        self.assertListEqual(list(module.binary_to_rows(spells)), rows)
+        self.assertListEqual([type(value) for key in spells.keys for value in key], [str, str])
+        self.assertEqual(type(spells.group_keys[0]), str)
+
+    def test_columns_are_memory_mapped(self):
+        module.csv_to_binary(self.rows(), self.path, group_keys=('id',))
+        spells = module.load(self.path)
+        self.failIf(spells.intervals.beginning.flags.owndata)
+        self.assertEqual(spells.intervals[0], Interval(('1991-01-01', '1991-01-31')))
+        self.failUnless(spells.intervals[4].is_empty)
+
+    def test_groups_in_order_of_first_appearance(self):
+        module.csv_to_binary(self.rows(), self.path, group_keys=('id',))
+        actual = [(key, len(intervals)) for (key, intervals) in module.load(self.path).groups()]
+        self.assertListEqual(actual, [(('1',), 2), (('2',), 1), (('3',), 2)])
+
+    def test_without_group_keys(self):
+        intervals = [Interval(('1991-01-01', '1991-01-31')), Interval(('1992-01-01', '1992-01-31'))]
+        module.save(self.path, intervals)
+        spells = module.load(self.path)
+        self.assertIsNone(spells.codes)
+        self.assertListEqual(list(spells.intervals), intervals)
+
+    def test_empty_file(self):
+        module.csv_to_binary([], self.path)
+        spells = module.load(self.path)
+        self.assertEqual(len(spells), 0)
+        self.assertListEqual(list(spells.groups()), [])
+
+    def test_chunks(self):
+        rows = [dict(frame_id=str(index % 7), start_date='1991-01-%02d' % (1 + index % 28), end_date='1991-02-01')
+                for index in range(1000)]
+        original = module.CHUNK_SIZE
+        module.CHUNK_SIZE = 64
+        try:
+            module.csv_to_binary(rows, self.path)
+        finally:
+            module.CHUNK_SIZE = original
+        self.assertListEqual(list(module.binary_to_rows(module.load(self.path))), rows)
+
+    def test_not_a_spell_file(self):
+        with open(self.path, 'wb') as output:
+            output.write(b'frame_id,start_date,end_date\n')
+        self.assertRaises(ValueError, module.load, self.path)
+
+    def test_same_as_alone(self):
+        module.csv_to_binary(self.rows(), self.path, group_keys=('id',))
+        tagged = alone.tag_groups(alone.read_as_dict_of_groups(self.rows(), group_keys=('id',)).items())
+        desired = dict(((row['id'], row['start_date']), row['days_alone']) for row in tagged)
+        actual = list(alone.tag_binary(module.load(self.path)))
+        self.assertListEqual([row['id'] for row in actual], ['1', '1', '2', '3', '3'])
+        self.assertDictEqual(dict(((row['id'], row['start_date']), row['days_alone']) for row in actual), desired)
+
+if __name__ == '__main__':
+    unittest.main()
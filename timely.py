@@ -1,13 +1,150 @@
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
-from dateutil.parser import parse
-from shapely.geometry import Point, LineString, MultiLineString
-from shapely.ops import linemerge
+from itertools import groupby
+from timeit import default_timer
+import atexit
+import imp
+import importlib
+import json
+import os
+import random
+import re
+import sys
+
+class LazyModule(object):
+	'''
+	Stands in for a module and imports it when one of its attributes is first used.
+	'''
+	def __init__(self, name):
+		self._name = name
+		self._module = None
+
+	def __getattr__(self, attribute):
+		if self._module is None:
+			self._module = importlib.import_module(self._name)
+		return getattr(self._module, attribute)
+
+def installed(name):
+	'''
+	Whether a top-level module can be imported, without importing it.
+	'''
+	try:
+		imp.find_module(name)
+	except ImportError:
+		return False
+	return True
+
+# NumPy takes longer to import than the rest of timely, and only IntervalArray and the batch functions use it
+numpy = LazyModule('numpy') if installed('numpy') else None
+
+# Shapely is only imported by load_shapely, for the Shapely backend and shape conversions
+Point = LineString = MultiPoint = MultiLineString = linemerge = None
+
+def load_shapely():
+	global Point, LineString, MultiPoint, MultiLineString, linemerge
+	if linemerge is None:
+		from shapely.geometry import Point, LineString, MultiPoint, MultiLineString
+		from shapely.ops import linemerge
 
 ORIGIN = datetime.fromordinal(1)
 _BOT = ORIGIN
 _EOT = datetime(9999,12,31)
+# instants are stored as integer microseconds since ORIGIN
+BOT_TIMESTAMP = 0
+EOT_TIMESTAMP = (_EOT-ORIGIN).days*86400*1000000
+
+# strptime format used for strings before trying ISO-8601 and dateutil, see set_date_format()
+DATE_FORMAT = None
+PARSE_CACHE_SIZE = 65536
+# Shapely geometries kept by canonical endpoints, 0 turns the cache off
+SHAPE_CACHE_SIZE = 1024
+_ISO_8601 = re.compile(r'(\d{4})-(\d\d)-(\d\d)(?:[T ](\d\d):(\d\d)(?::(\d\d)(?:\.(\d{1,6}))?)?)?$')
+
+class LRUCache(object):
+	'''
+	A mapping of at most 'size' items that drops the least recently used one when full.
+	'''
+	def __init__(self, size):
+		self.size = size
+		self.items = OrderedDict()
+		self.hits = 0
+		self.misses = 0
+
+	def get(self, key, default=None):
+		try:
+			value = self.items.pop(key)
+		except KeyError:
+			self.misses += 1
+			return default
+		self.items[key] = value
+		self.hits += 1
+		return value
+
+	def set(self, key, value):
+		if self.size <= 0:
+			return
+		if key in self.items:
+			del self.items[key]
+		elif len(self.items) >= self.size:
+			self.items.popitem(last=False)
+		self.items[key] = value
+
+	def clear(self):
+		self.items.clear()
+		self.hits = 0
+		self.misses = 0
+
+	def info(self):
+		return dict(hits=self.hits, misses=self.misses, size=len(self.items), maxsize=self.size)
+
+	def __len__(self):
+		return len(self.items)
+
+parse_cache = LRUCache(PARSE_CACHE_SIZE)
+
+def set_date_format(format):
+	'''
+	Sets the strptime format tried first when parsing strings. None goes back to ISO-8601 and dateutil only.
+	'''
+	global DATE_FORMAT
+	DATE_FORMAT = format
+	parse_cache.clear()
+
+def parse_iso8601(string):
+	'''
+	Parses the common ISO-8601 forms without dateutil. Returns None for anything else.
+	'''
+	match = _ISO_8601.match(string)
+	if match is None:
+		return None
+	(year, month, day, hour, minute, second, fraction) = match.groups()
+	return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0), int((fraction or '0').ljust(6, '0')))
 
-def coerce(what):
+def parse_date(string, format=None):
+	'''
+	Parses 'string' with 'format', as ISO-8601, or with dateutil, whichever works first. Results are memoized.
+	'''
+	format = format or DATE_FORMAT
+	key = (string, format)
+	value = parse_cache.get(key)
+	if value is None:
+		if format is not None:
+			try:
+				value = datetime.strptime(string, format)
+			except ValueError:
+				pass
+		if value is None:
+			value = parse_iso8601(string)
+		if value is None:
+			# dateutil is only imported for strings that are neither in 'format' nor ISO-8601
+			from dateutil.parser import parse
+			value = parse(string)
+		parse_cache.set(key, value)
+	return value
+
+def coerce(what, format=None):
 	'''
 	Coerces 'what' into a date.
 	'''
@@ -16,28 +153,37 @@ def coerce(what):
 	if isinstance(what, datetime):
 		return what
 	if isinstance(what, basestring):
-		return parse(what)
+		return parse_date(what, format)
 
 def simplify(shape):
+	load_shapely()
 	if isinstance(shape, MultiLineString):
 		return linemerge(shape)
 	return shape
 
 def shape_as_time(shape):
-	simple = simplify(shape)
-	if isinstance(simple, Point):
+	return _simple_shape_as_time(simplify(shape))
+
+def _simple_shape_as_time(shape):
+	# the segments of a simplified MultiLineString are already merged
+	if shape.is_empty:
+		return Instant('', empty=True)
+	if isinstance(shape, Point):
 		t = ORIGIN+x_as_timedelta(shape.x)
 		return Instant(t)
-	if isinstance(simple, LineString):
+	if isinstance(shape, LineString):
 		(x1, _, x2, __) = shape.bounds
 		t1 = ORIGIN+x_as_timedelta(x1)
 		t2 = ORIGIN+x_as_timedelta(x2)
 		return Interval((t1, t2))
 	if isinstance(shape, MultiLineString):
-		return MultiInterval([shape_as_time(segment) for segment in shape.geoms])
+		return MultiInterval([_simple_shape_as_time(segment) for segment in shape.geoms])
+	if isinstance(shape, MultiPoint):
+		return MultiInstant([_simple_shape_as_time(point) for point in shape.geoms])
 	return Instant('', empty=True)
 
 def time_as_shape(timelyobject):
+	load_shapely()
 	if isinstance(timelyobject, Instant):
 		if timelyobject.is_empty:
 			return Point()
@@ -53,36 +199,497 @@ def time_as_shape(timelyobject):
 		if timelyobject.is_empty:
 			return MultiLineString()
 		return MultiLineString([time_as_shape(interval) for interval in timelyobject.intervals])
+	if isinstance(timelyobject, MultiInstant):
+		if timelyobject.is_empty:
+			return MultiPoint()
+		return MultiPoint([time_as_shape(instant) for instant in timelyobject.instants])
 	return Point()
 
+shape_cache = LRUCache(SHAPE_CACHE_SIZE)
+
+def cached_shape(timelyobject):
+	'''
+	time_as_shape, memoized in shape_cache by the object's endpoints and, for a MultiInterval, on the object itself.
+	Hits and misses are counted in shape_cache.
+	'''
+	if isinstance(timelyobject, MultiInterval) and timelyobject._shape is not None:
+		shape_cache.hits += 1
+		return timelyobject._shape
+	key = (type(timelyobject).__name__, timelyobject._key())
+	shape = shape_cache.get(key)
+	if shape is None:
+		shape = time_as_shape(timelyobject)
+		shape_cache.set(key, shape)
+	if isinstance(timelyobject, MultiInterval):
+		timelyobject._shape = shape
+	return shape
+
 def timedelta_as_x(t):
-	# time is measured in days
-	return float(t.days)
+	# Shapely coordinates are float days, exact to about 40 microseconds near _EOT.
+	# The native backend works on integer timestamps instead.
+	return t.days + (t.seconds + t.microseconds/1e6)/86400.0
 
 def x_as_timedelta(x):
 	return timedelta(days=x)
 
+def datetime_as_timestamp(t):
+	return timedelta_as_timestamp(t-ORIGIN)
+
+def timestamp_as_datetime(timestamp):
+	return ORIGIN+timedelta(microseconds=timestamp)
+
+def timestamp_as_timedelta(timestamp):
+	return timedelta(microseconds=timestamp)
+
+def timedelta_as_timestamp(t):
+	return (t.days*86400 + t.seconds)*1000000 + t.microseconds
+
+def runs(timelyobject):
+	'''
+	Returns the sorted, disjoint (begin, end) endpoint pairs covered by 'timelyobject'.
+	Instants are degenerate runs with begin == end.
+	'''
+	if timelyobject.is_empty:
+		return []
+	if isinstance(timelyobject, Instant):
+		return [(timelyobject.timestamp, timelyobject.timestamp)]
+	if isinstance(timelyobject, Interval):
+		return [timelyobject.timestamps]
+	if isinstance(timelyobject, MultiInterval):
+		return timelyobject.timestamps
+	if isinstance(timelyobject, MultiInstant):
+		return [(t, t) for t in timelyobject.timestamps]
+	return []
+
+def runs_as_time(list_of_runs):
+	'''
+	Inverse of runs(). Isolated points next to proper intervals are dropped, as a MultiInterval only holds intervals.
+	'''
+	if not list_of_runs:
+		return Instant('', empty=True)
+	if len(list_of_runs) == 1:
+		(b, e) = list_of_runs[0]
+		if b == e:
+			return Instant.from_timestamp(b)
+		return Interval.from_timestamps(b, e)
+	if all([b == e for (b, e) in list_of_runs]):
+		return MultiInstant.from_timestamps([b for (b, e) in list_of_runs])
+	list_of_runs = [(b, e) for (b, e) in list_of_runs if b < e]
+	if len(list_of_runs) == 1:
+		return Interval.from_timestamps(*list_of_runs[0])
+	return MultiInterval.from_timestamps(list_of_runs)
+
+def merge_runs(sorted_runs):
+	# runs are closed, so touching runs are coalesced
+	output = []
+	for (b, e) in sorted_runs:
+		if output and b <= output[-1][1]:
+			if e > output[-1][1]:
+				output[-1] = (output[-1][0], e)
+		else:
+			output.append((b, e))
+	return output
+
+def union_runs(a, b):
+	output = []
+	i = j = 0
+	while i < len(a) or j < len(b):
+		if j == len(b) or (i < len(a) and a[i] <= b[j]):
+			run = a[i]
+			i += 1
+		else:
+			run = b[j]
+			j += 1
+		if output and run[0] <= output[-1][1]:
+			if run[1] > output[-1][1]:
+				output[-1] = (output[-1][0], run[1])
+		else:
+			output.append(run)
+	return output
+
+def intersection_runs(a, b):
+	output = []
+	i = j = 0
+	while i < len(a) and j < len(b):
+		begin = max(a[i][0], b[j][0])
+		end = min(a[i][1], b[j][1])
+		if begin <= end:
+			output.append((begin, end))
+		if a[i][1] < b[j][1]:
+			i += 1
+		else:
+			j += 1
+	return output
+
+def difference_runs(a, b):
+	# the closure of a minus b: removing points from a proper interval leaves it unchanged
+	output = []
+	j = 0
+	for (begin, end) in a:
+		while j < len(b) and b[j][1] < begin:
+			j += 1
+		if begin == end:
+			if not (j < len(b) and b[j][0] <= begin):
+				output.append((begin, end))
+			continue
+		cursor = begin
+		k = j
+		while k < len(b) and b[k][0] < end:
+			(b_begin, b_end) = b[k]
+			if b_begin < b_end:
+				if b_begin > cursor:
+					output.append((cursor, b_begin))
+				cursor = max(cursor, b_end)
+			k += 1
+		if cursor < end:
+			output.append((cursor, end))
+	return output
+
+def runs_intersect(a, b):
+	i = j = 0
+	while i < len(a) and j < len(b):
+		if max(a[i][0], b[j][0]) <= min(a[i][1], b[j][1]):
+			return True
+		if a[i][1] < b[j][1]:
+			i += 1
+		else:
+			j += 1
+	return False
+
+def runs_contain(a, b):
+	# as in Shapely, b must not lie entirely on the boundary of a
+	if not a or not b:
+		return False
+	interior = False
+	i = 0
+	for (begin, end) in b:
+		while i < len(a) and a[i][1] < begin:
+			i += 1
+		if i == len(a) or not (a[i][0] <= begin and end <= a[i][1]):
+			return False
+		(a_begin, a_end) = a[i]
+		if begin < end or a_begin == a_end or a_begin < begin < a_end:
+			interior = True
+	return interior
+
+def runs_distance(a, b):
+	distance = 0
+	if not a or not b:
+		return distance
+	i = j = 0
+	gap = None
+	while i < len(a) and j < len(b):
+		begin = max(a[i][0], b[j][0])
+		end = min(a[i][1], b[j][1])
+		if begin <= end:
+			return distance
+		if gap is None or begin-end < gap:
+			gap = begin-end
+		if a[i][1] < b[j][1]:
+			i += 1
+		else:
+			j += 1
+	return gap
+
+def runs_length(list_of_runs):
+	return sum([e-b for (b, e) in list_of_runs])
+
+class NativeBackend(object):
+	'''
+	Set operations as linear merges of sorted endpoint pairs.
+	'''
+	name = 'native'
+
+	def length(self, a):
+		return timestamp_as_timedelta(runs_length(runs(a)))
+
+	def equals(self, a, b):
+		return runs(a) == runs(b)
+
+	def contains(self, a, b):
+		if isinstance(a, MultiInterval) and isinstance(b, Instant) and not b.is_empty:
+			run = a.run_at(b.timestamp)
+			return run is not None and run[0] < b.timestamp < run[1]
+		if isinstance(a, MultiInstant) and isinstance(b, Instant) and not b.is_empty:
+			return a.has_timestamp(b.timestamp)
+		return runs_contain(runs(a), runs(b))
+
+	def disjoint(self, a, b):
+		return not self.intersects(a, b)
+
+	def intersects(self, a, b):
+		if isinstance(a, MultiInterval) and isinstance(b, Instant) and not b.is_empty:
+			return a.run_at(b.timestamp) is not None
+		if isinstance(a, MultiInstant) and isinstance(b, Instant) and not b.is_empty:
+			return a.has_timestamp(b.timestamp)
+		return runs_intersect(runs(a), runs(b))
+
+	def distance(self, a, b):
+		return timestamp_as_timedelta(runs_distance(runs(a), runs(b)))
+
+	def difference(self, a, b):
+		return runs_as_time(difference_runs(runs(a), runs(b)))
+
+	def intersection(self, a, b):
+		return runs_as_time(intersection_runs(runs(a), runs(b)))
+
+	def union(self, a, b):
+		return runs_as_time(union_runs(runs(a), runs(b)))
+
+def geos(operation, a, b):
+	# a single call into GEOS, separate so that profiling can time it
+	return getattr(a, operation)(b)
+
+class ShapelyBackend(object):
+	'''
+	Set operations on Shapely geometries. Slower, kept as a reference implementation.
+	'''
+	name = 'shapely'
+
+	def __init__(self):
+		load_shapely()
+
+	def length(self, a):
+		return x_as_timedelta(cached_shape(a).length)
+
+	def equals(self, a, b):
+		return geos('equals', cached_shape(a), cached_shape(b))
+
+	def contains(self, a, b):
+		return geos('contains', cached_shape(a), cached_shape(b))
+
+	def disjoint(self, a, b):
+		return geos('disjoint', cached_shape(a), cached_shape(b))
+
+	def intersects(self, a, b):
+		return geos('intersects', cached_shape(a), cached_shape(b))
+
+	def distance(self, a, b):
+		return x_as_timedelta(geos('distance', cached_shape(a), cached_shape(b)))
+
+	def difference(self, a, b):
+		return shape_as_time(geos('difference', cached_shape(a), cached_shape(b)))
+
+	def intersection(self, a, b):
+		return shape_as_time(geos('intersection', cached_shape(a), cached_shape(b)))
+
+	def union(self, a, b):
+		return shape_as_time(geos('union', cached_shape(a), cached_shape(b)))
+
+# backend classes by name, or the 'module.attribute' path of a class that is imported when the backend is selected
+BACKENDS = {NativeBackend.name: NativeBackend, ShapelyBackend.name: ShapelyBackend}
+backend = NativeBackend()
+
+def register_backend(name, factory):
+	'''
+	Makes a backend available to use_backend. 'factory' is a class or its 'module.attribute' path.
+	'''
+	BACKENDS[name] = factory
+
+def use_backend(name):
+	'''
+	Selects the backend used by all set operations and returns the name of the previous one.
+	'''
+	global backend
+	factory = BACKENDS[name]
+	if isinstance(factory, basestring):
+		(module, _, attribute) = factory.rpartition('.')
+		factory = BACKENDS[name] = getattr(importlib.import_module(module), attribute)
+	previous = backend.name
+	backend = factory()
+	return previous
+
+# module functions timed by enable_profiling(), with their stage names
+PROFILED_FUNCTIONS = (
+	('parse_date', 'parse'),
+	('time_as_shape', 'time_as_shape'),
+	('geos', 'geos'),
+	('shape_as_time', 'shape_as_time'),
+	('simplify', 'linemerge'),
+	('union_runs', 'native union'),
+	('intersection_runs', 'native intersection'),
+	('difference_runs', 'native difference'),
+	('runs_intersect', 'native intersects'),
+	('runs_contain', 'native contains'),
+	('runs_distance', 'native distance'),
+)
+# upper bounds of the latency histogram buckets, in seconds
+LATENCY_BOUNDS = (1e-6, 1e-5, 1e-4, 1e-3, 1e-2, 1e-1, 1.0)
+LATENCY_LABELS = ('<1us', '<10us', '<100us', '<1ms', '<10ms', '<100ms', '<1s', '>=1s')
+
+class Profiler(object):
+	'''
+	Call counts, cumulative time and a latency histogram for each stage. The time of a stage excludes the stages it
+	calls, so the seconds add up to the time spent in all of them.
+	'''
+	def __init__(self):
+		self.stages = {}
+
+	def record(self, stage, elapsed):
+		stats = self.stages.get(stage)
+		if stats is None:
+			stats = self.stages[stage] = [0, 0.0, [0]*len(LATENCY_LABELS)]
+		stats[0] += 1
+		stats[1] += elapsed
+		stats[2][bisect_right(LATENCY_BOUNDS, elapsed)] += 1
+
+	def summary(self):
+		return dict((stage, dict(calls=calls, seconds=seconds, histogram=dict(zip(LATENCY_LABELS, histogram))))
+			for (stage, (calls, seconds, histogram)) in self.stages.items())
+
+	def merge(self, summary):
+		'''
+		Adds the summary() of another profiler, e.g. from a worker process.
+		'''
+		for (stage, stats) in summary.items():
+			if stage not in self.stages:
+				self.stages[stage] = [0, 0.0, [0]*len(LATENCY_LABELS)]
+			mine = self.stages[stage]
+			mine[0] += stats['calls']
+			mine[1] += stats['seconds']
+			for (position, label) in enumerate(LATENCY_LABELS):
+				mine[2][position] += stats['histogram'][label]
+
+	def reset(self):
+		self.stages = {}
+
+	def report(self):
+		lines = ['%-20s %10s %12s  %s' % ('stage', 'calls', 'seconds', ' '.join(['%8s' % label for label in LATENCY_LABELS]))]
+		for (stage, (calls, seconds, histogram)) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+			lines.append('%-20s %10d %12.6f  %s' % (stage, calls, seconds, ' '.join(['%8d' % count for count in histogram])))
+		return '\n'.join(lines) + '\n'
+
+	def dump(self, path=None):
+		'''
+		Writes summary() as JSON to 'path', or to stderr.
+		'''
+		if path is None:
+			json.dump(self.summary(), sys.stderr, indent=1, sort_keys=True)
+			sys.stderr.write('\n')
+		else:
+			with open(path, 'w') as output:
+				json.dump(self.summary(), output, indent=1, sort_keys=True)
+
+# the active Profiler, None when profiling is off
+profiler = None
+# [stage, seconds in other stages] of each timed call in progress, innermost last
+_running_stages = []
+
+def _profiled(stage, function):
+	def wrapper(*arguments, **keywords):
+		# a stage that calls itself, such as shape_as_time for each segment, is timed once by its outermost call
+		for (running, _) in _running_stages:
+			if running == stage:
+				return function(*arguments, **keywords)
+		frame = [stage, 0.0]
+		_running_stages.append(frame)
+		start = default_timer()
+		try:
+			return function(*arguments, **keywords)
+		finally:
+			elapsed = default_timer()-start
+			_running_stages.pop()
+			if _running_stages:
+				_running_stages[-1][1] += elapsed
+			if profiler is not None:
+				# self time: stages called from this one are recorded under their own names
+				profiler.record(stage, elapsed-frame[1])
+	wrapper.__name__ = function.__name__
+	wrapper.__doc__ = function.__doc__
+	wrapper.profiled = function
+	return wrapper
+
+def enable_profiling():
+	'''
+	Starts timing the stages in PROFILED_FUNCTIONS and returns the Profiler. When off, no timing code runs at all,
+	as the module functions are only replaced by timed wrappers here.
+	'''
+	global profiler
+	if profiler is None:
+		profiler = Profiler()
+		module = globals()
+		for (name, stage) in PROFILED_FUNCTIONS:
+			module[name] = _profiled(stage, module[name])
+	return profiler
+
+def disable_profiling():
+	'''
+	Restores the untimed functions and returns the Profiler that was active, if any.
+	'''
+	global profiler
+	module = globals()
+	for (name, stage) in PROFILED_FUNCTIONS:
+		module[name] = getattr(module[name], 'profiled', module[name])
+	(previous, profiler) = (profiler, None)
+	return previous
+
+@contextmanager
+def profiling():
+	'''
+	with profiling() as profiler: ... times the stages inside the block.
+	'''
+	active = profiler is not None
+	try:
+		yield enable_profiling()
+	finally:
+		if not active:
+			disable_profiling()
+
 class TimelyObject(object):
+	__slots__ = ()
+
 	# properties
 	# properties
 	@property
 	def length(self):
-		return x_as_timedelta(time_as_shape(self).length)
+		return backend.length(self)
 
 	@property
 	def bounds(self):
 		raise NotImplementedError
 
-	# binary relations
-	# pythonic style
+	# value semantics
+	# objects are immutable and compare by their runs, so equal objects have the same hash whatever their class
+	# and whatever the backend; <, <=, > and >= follow the lexicographic order of runs, a total order for sorted()
+	# and bisect in which empty objects come first. precedes and follows relate objects in time instead
+	def _key(self):
+		raise NotImplementedError
+
 	def __eq__(self, other):
-		return self.equals(other)
+		if not isinstance(other, TimelyObject):
+			return NotImplemented
+		return self._key() == other._key()
+
+	def __ne__(self, other):
+		if not isinstance(other, TimelyObject):
+			return NotImplemented
+		return self._key() != other._key()
+
+	def __hash__(self):
+		return hash(self._key())
+
+	def __lt__(self, other):
+		if not isinstance(other, TimelyObject):
+			return NotImplemented
+		return self._key() < other._key()
 
 	def __le__(self, other):
-		return self.bounds[1]<=other.bounds[0]
+		if not isinstance(other, TimelyObject):
+			return NotImplemented
+		return self._key() <= other._key()
+
+	def __gt__(self, other):
+		if not isinstance(other, TimelyObject):
+			return NotImplemented
+		return self._key() > other._key()
 
 	def __ge__(self, other):
-		return self.bounds[0]>=other.bounds[1]
+		if not isinstance(other, TimelyObject):
+			return NotImplemented
+		return self._key() >= other._key()
+
+	# binary relations
+	# pythonic style
 
 	def __add__(self, other):
 		return self.union(other)
@@ -111,31 +718,44 @@ class TimelyObject(object):
 	def __iter__(self, other):
 		raise NotImplementedError
 
+	def precedes(self, other):
+		'''
+		Whether this object ends no later than 'other' begins. False if either is empty.
+		'''
+		(end, beginning) = (self.bounds[1].timestamp, other.bounds[0].timestamp)
+		return end is not None and beginning is not None and end <= beginning
+
+	def follows(self, other):
+		'''
+		Whether this object begins no earlier than 'other' ends. False if either is empty.
+		'''
+		return other.precedes(self)
+
 	# shapely style
 	def equals(self, other):
-		return time_as_shape(self).equals(time_as_shape(other))
+		return backend.equals(self, other)
 
 	def contains(self, other):
-		return time_as_shape(self).contains(time_as_shape(other))
+		return backend.contains(self, other)
 
 	def disjoint(self, other):
-		return time_as_shape(self).disjoint(time_as_shape(other))
+		return backend.disjoint(self, other)
 
 	def intersects(self, other):
-		return time_as_shape(self).intersects(time_as_shape(other))
+		return backend.intersects(self, other)
 
 	def distance(self, other):
-		return x_as_timedelta(time_as_shape(self).distance(time_as_shape(other)))
+		return backend.distance(self, other)
 
 	# binary operators
 	def difference(self, other):
-		return shape_as_time(time_as_shape(self).difference(time_as_shape(other)))
+		return backend.difference(self, other)
 
 	def intersection(self, other):
-		return shape_as_time(time_as_shape(self).intersection(time_as_shape(other)))
+		return backend.intersection(self, other)
 
 	def union(self, other):
-		return shape_as_time(time_as_shape(self).union(time_as_shape(other)))
+		return backend.union(self, other)
 
 	# unary constructors
 	def offset(self, difference):
@@ -149,20 +769,59 @@ class TimelyObject(object):
 		return unicode(self)
 
 class Instant(TimelyObject):
+	# an integer count of microseconds since ORIGIN, or None when empty
+	__slots__ = ('_timestamp',)
+
 	def __init__(self, what, BOT=False, EOT=False, empty=False):
 		assert not (BOT and EOT)
-		if not (not what or BOT or EOT or empty):
-			self.datetime = coerce(what)
-		else:
-			if empty or not what:
-				self.datetime = None
-			if BOT:
-				self.datetime = _BOT
-			if EOT:
-				self.datetime = _EOT
-		self.BOT = BOT
-		self.EOT = EOT
-		self.is_empty = empty or (not what and not (BOT or EOT))
+		if isinstance(what, Instant) and not (BOT or EOT or empty):
+			self._timestamp = what.timestamp
+		elif BOT:
+			self._timestamp = BOT_TIMESTAMP
+		elif EOT:
+			self._timestamp = EOT_TIMESTAMP
+		elif empty or not what:
+			self._timestamp = None
+		else:
+			self._timestamp = datetime_as_timestamp(coerce(what))
+
+	@classmethod
+	def from_timestamp(cls, timestamp):
+		instant = cls.__new__(cls)
+		instant._timestamp = timestamp
+		return instant
+
+	def __getstate__(self):
+		# a tuple, because a false state such as BOT_TIMESTAMP would not be restored
+		return (self._timestamp,)
+
+	def __setstate__(self, state):
+		(self._timestamp,) = state
+
+	@property
+	def timestamp(self):
+		return self._timestamp
+
+	def _key(self):
+		return ((self._timestamp, self._timestamp),) if self._timestamp is not None else ()
+
+	@property
+	def datetime(self):
+		if self.timestamp is None:
+			return None
+		return timestamp_as_datetime(self.timestamp)
+
+	@property
+	def BOT(self):
+		return self.timestamp == BOT_TIMESTAMP
+
+	@property
+	def EOT(self):
+		return self.timestamp == EOT_TIMESTAMP
+
+	@property
+	def is_empty(self):
+		return self.timestamp is None
 
 	def __unicode__(self):
 		if not self.is_empty:
@@ -174,34 +833,66 @@ class Instant(TimelyObject):
 	def bounds(self):
 		return (self, self)
 
-	def __le__(self, other):
-		if self.is_empty or other.is_empty:
-			# empty instants cannot be compared
-			return False
-		return self.BOT or other.EOT or (not self.EOT and not other.BOT and self.datetime<=other.datetime)
-
-	def __ge__(self, other):
-		return other<=self
+	def offset(self, difference):
+		if self.is_empty or self.BOT or self.EOT:
+			return self
+		return Instant.from_timestamp(self.timestamp+timedelta_as_timestamp(difference))
 
 
 class Interval(TimelyObject):
+	# timestamps of the beginning and the end, both None when empty
+	__slots__ = ('_beginning', '_end')
+
 	def __init__(self, what, empty=False):
-		if empty:
-			self.is_empty = True
-		else:
-			self.is_empty = empty
+		self._beginning = self._end = None
+		if not empty:
 			if isinstance(what, basestring):
 				(b, e) = what.split('/')
 			else:
 				(b, e) = what
-			self.beginning = Instant(b)
-			self.end = Instant(e)
-			if self.end<=self.beginning:
-				self.is_empty = True
-			if self.beginning.is_empty:
-				self.beginning = Instant('', BOT=True)
-			if self.end.is_empty:
-				self.end = Instant('', EOT=True)
+			b = Instant(b).timestamp
+			e = Instant(e).timestamp
+			# an open beginning or end extends to the beginning or end of time
+			if b is None:
+				b = BOT_TIMESTAMP
+			if e is None:
+				e = EOT_TIMESTAMP
+			if b < e:
+				(self._beginning, self._end) = (b, e)
+
+	@classmethod
+	def from_timestamps(cls, beginning, end):
+		interval = cls.__new__(cls)
+		if beginning < end:
+			(interval._beginning, interval._end) = (beginning, end)
+		else:
+			interval._beginning = interval._end = None
+		return interval
+
+	def __getstate__(self):
+		return (self._beginning, self._end)
+
+	def __setstate__(self, state):
+		(self._beginning, self._end) = state
+
+	@property
+	def timestamps(self):
+		return (self._beginning, self._end)
+
+	def _key(self):
+		return ((self._beginning, self._end),) if self._beginning is not None else ()
+
+	@property
+	def beginning(self):
+		return Instant.from_timestamp(self._beginning)
+
+	@property
+	def end(self):
+		return Instant.from_timestamp(self._end)
+
+	@property
+	def is_empty(self):
+		return self._beginning is None
 
 	def __unicode__(self):
 		if not self.is_empty:
@@ -213,23 +904,171 @@ class Interval(TimelyObject):
 	def bounds(self):
 		return (self.beginning, self.end)
 
-	def split(self, instant):
-		if instant in self:
-			(b, e) = self.bounds
-			x = instant
-			return MultiInterval([Interval((b, x)), Interval((x, e))])
-		return self
+	def offset(self, difference):
+		if self.is_empty:
+			return self
+		return Interval((self.beginning.offset(difference), self.end.offset(difference)))
+
+	def split(self, instants):
+		'''
+		Yields the consecutive segments of the interval between cut points. 'instants' is a single cut point, an
+		Instant, a date string or a datetime, or an iterable of them. Cut points outside the interval or on its ends
+		are ignored.
+		'''
+		if self.is_empty:
+			return
+		# a string would otherwise be iterated character by character
+		if isinstance(instants, (Instant, basestring, datetime)):
+			instants = [instants]
+		(b, e) = self.timestamps
+		timestamps = set()
+		for instant in instants:
+			timestamp = instant.timestamp if isinstance(instant, Instant) else Instant(instant).timestamp
+			if timestamp is not None and b < timestamp < e:
+				timestamps.add(timestamp)
+		for timestamp in sorted(timestamps):
+			yield Interval.from_timestamps(b, timestamp)
+			b = timestamp
+		yield Interval.from_timestamps(b, e)
 
 class MultiInstant(TimelyObject):
-	pass
+	# sorted, distinct timestamps
+	__slots__ = ('_timestamps',)
+
+	def __init__(self, list_of_instants, empty=False):
+		timestamps = set()
+		if not empty:
+			for instant in list_of_instants:
+				timestamp = instant.timestamp if isinstance(instant, Instant) else Instant(instant).timestamp
+				if timestamp is not None:
+					timestamps.add(timestamp)
+		self._timestamps = tuple(sorted(timestamps))
+
+	@classmethod
+	def from_timestamps(cls, timestamps):
+		'''
+		Builds a MultiInstant from timestamps that are already sorted and distinct.
+		'''
+		multiinstant = cls.__new__(cls)
+		multiinstant._timestamps = tuple(timestamps)
+		return multiinstant
+
+	@classmethod
+	def from_strings(cls, strings, format=None):
+		'''
+		Parses many date strings at once with parse_date. Empty strings are skipped.
+		'''
+		return cls.from_timestamps(sorted(set([datetime_as_timestamp(parse_date(string, format)) for string in strings if string])))
+
+	def __getstate__(self):
+		return (self._timestamps,)
+
+	def __setstate__(self, state):
+		(self._timestamps,) = state
+
+	@property
+	def timestamps(self):
+		return list(self._timestamps)
+
+	def _key(self):
+		return tuple([(t, t) for t in self._timestamps])
+
+	@property
+	def instants(self):
+		return [Instant.from_timestamp(t) for t in self._timestamps]
+
+	@property
+	def is_empty(self):
+		return not self._timestamps
+
+	def __len__(self):
+		return len(self._timestamps)
+
+	def __iter__(self):
+		for t in self._timestamps:
+			yield Instant.from_timestamp(t)
+
+	def has_timestamp(self, timestamp):
+		# a binary search
+		index = bisect_left(self._timestamps, timestamp)
+		return index < len(self._timestamps) and self._timestamps[index] == timestamp
+
+	def within(self, other):
+		'''
+		The instants that intersect 'other', an Interval or a MultiInterval, ends included. A binary search per run.
+		'''
+		output = []
+		for (b, e) in runs(other):
+			output.extend(self._timestamps[bisect_left(self._timestamps, b):bisect_right(self._timestamps, e)])
+		return MultiInstant.from_timestamps(output)
+
+	def __unicode__(self):
+		if not self.is_empty:
+			return u','.join([unicode(i) for i in self.instants])
+		else:
+			return 'Empty MultiInstant'
+
+	@property
+	def bounds(self):
+		if self.is_empty:
+			return (Instant('', empty=True), Instant('', empty=True))
+		return (Instant.from_timestamp(self._timestamps[0]), Instant.from_timestamp(self._timestamps[-1]))
 
 class MultiInterval(TimelyObject):
+	# sorted, disjoint and non-touching runs, as parallel tuples of beginning and end timestamps,
+	# and the Shapely geometry once cached_shape has built it
+	__slots__ = ('_beginnings', '_ends', '_shape')
+
 	def __init__(self, list_of_intervals, empty=False):
-		if empty:
-			self.is_empty = True
-		else:
-			self.is_empty = empty
-			self.intervals = list_of_intervals
+		list_of_runs = []
+		if not empty:
+			list_of_runs = merge_runs(sorted([run for interval in list_of_intervals for run in runs(interval) if run[0] < run[1]]))
+		self._set_timestamps(list_of_runs)
+
+	@classmethod
+	def from_timestamps(cls, list_of_runs):
+		'''
+		Builds a MultiInterval from (beginning, end) timestamps that are already sorted, disjoint and non-touching.
+		'''
+		multiinterval = cls.__new__(cls)
+		multiinterval._set_timestamps(list_of_runs)
+		return multiinterval
+
+	def _set_timestamps(self, list_of_runs):
+		self._beginnings = tuple([b for (b, e) in list_of_runs])
+		self._ends = tuple([e for (b, e) in list_of_runs])
+		self._shape = None
+
+	def __getstate__(self):
+		return (self._beginnings, self._ends)
+
+	def __setstate__(self, state):
+		(self._beginnings, self._ends) = state
+		self._shape = None
+
+	@property
+	def timestamps(self):
+		return list(zip(self._beginnings, self._ends))
+
+	def _key(self):
+		return tuple(zip(self._beginnings, self._ends))
+
+	@property
+	def intervals(self):
+		return [Interval.from_timestamps(b, e) for (b, e) in zip(self._beginnings, self._ends)]
+
+	@property
+	def is_empty(self):
+		return not self._beginnings
+
+	def run_at(self, timestamp):
+		'''
+		The (beginning, end) run that includes 'timestamp', or None. A binary search.
+		'''
+		index = bisect_right(self._beginnings, timestamp)-1
+		if index >= 0 and timestamp <= self._ends[index]:
+			return (self._beginnings[index], self._ends[index])
+		return None
 
 	def __unicode__(self):
 		if not self.is_empty:
@@ -239,7 +1078,901 @@ class MultiInterval(TimelyObject):
 
 	@property
 	def bounds(self):
-		b = min([i.beginning for i in self.intervals])
-		e = max([i.end for i in self.intervals])
-		return (b, e)
+		if self.is_empty:
+			return (Instant('', empty=True), Instant('', empty=True))
+		return (Instant.from_timestamp(self._beginnings[0]), Instant.from_timestamp(self._ends[-1]))
+
+	@property
+	def envelope(self):
+		if self.is_empty:
+			return Interval(None, empty=True)
+		return Interval.from_timestamps(self._beginnings[0], self._ends[-1])
+
+
+class InternTable(object):
+	'''
+	Canonical instances of time objects, so that repeated values share one object, as with intern() for strings.
+	Objects of different classes are kept apart even when they are equal.
+	'''
+	def __init__(self):
+		self.table = {}
+
+	def intern(self, timelyobject):
+		return self.table.setdefault((type(timelyobject), timelyobject._key()), timelyobject)
+
+	def clear(self):
+		self.table.clear()
+
+	def __len__(self):
+		return len(self.table)
+
+def counts_from_timestamps(beginnings, ends):
+	'''
+	Step function of the number of (beginning, end) runs covering the timeline, from a single sorted sweep.
+	'''
+	# one sort of plain integers: the lowest bit tells beginnings from ends
+	events = [b << 1 | 1 for b in beginnings]
+	events.extend([e << 1 for e in ends])
+	events.sort()
+	output = []
+	count = 0
+	previous = None
+	for event in events:
+		t = event >> 1
+		if t != previous:
+			if previous is not None:
+				if output and output[-1][2] == count:
+					output[-1][1] = t
+				else:
+					output.append([previous, t, count])
+			previous = t
+		if event & 1:
+			count += 1
+		else:
+			count -= 1
+	return [(Interval.from_timestamps(b, e), count) for (b, e, count) in output]
+
+def coverage_counts(items, key=None, spell=None):
+	'''
+	The number of intervals covering each segment of the timeline, as a list of (Interval, count) pairs.
+	Segments run from the earliest beginning to the latest end and neighbouring segments have different counts.
+	With a key function, returns a dictionary of such lists by key(item). spell(item) gives the Interval of an item,
+	by default the item itself.
+	'''
+	groups = {}
+	for item in items:
+		interval = spell(item) if spell is not None else item
+		if interval.is_empty:
+			continue
+		group = key(item) if key is not None else None
+		if group not in groups:
+			groups[group] = ([], [])
+		(beginnings, ends) = groups[group]
+		(b, e) = interval.timestamps
+		beginnings.append(b)
+		ends.append(e)
+	output = dict((group, counts_from_timestamps(beginnings, ends)) for (group, (beginnings, ends)) in groups.items())
+	if key is None:
+		return output.get(None, [])
+	return output
+
+def _endpoints(timelyobject):
+	# (beginning, end) timestamps of an Instant or an Interval, None when empty
+	if isinstance(timelyobject, Instant):
+		return (timelyobject.timestamp, timelyobject.timestamp) if not timelyobject.is_empty else None
+	if isinstance(timelyobject, Interval):
+		return timelyobject.timestamps if not timelyobject.is_empty else None
+	raise TypeError('Expected an Instant or an Interval, not %s.' % type(timelyobject).__name__)
+
+def _paired_endpoints(left, right):
+	'''
+	Endpoints of left and right elementwise, broadcasting a single Instant or Interval against a sequence.
+	'''
+	if isinstance(left, TimelyObject) and isinstance(right, TimelyObject):
+		return [(_endpoints(left), _endpoints(right))]
+	if isinstance(left, TimelyObject):
+		endpoints = _endpoints(left)
+		return [(endpoints, _endpoints(other)) for other in right]
+	if isinstance(right, TimelyObject):
+		endpoints = _endpoints(right)
+		return [(_endpoints(other), endpoints) for other in left]
+	if len(left) != len(right):
+		raise ValueError('Sequences of different lengths: %d and %d.' % (len(left), len(right)))
+	return [(_endpoints(a), _endpoints(b)) for (a, b) in zip(left, right)]
+
+def _paired_arrays(left, right):
+	if not isinstance(left, IntervalArray):
+		left = _as_interval_array(left, len(right))
+	if not isinstance(right, IntervalArray):
+		right = _as_interval_array(right, len(left))
+	if len(left) != len(right):
+		raise ValueError('Sequences of different lengths: %d and %d.' % (len(left), len(right)))
+	return (left, right)
+
+def _as_interval_array(intervals, length):
+	if isinstance(intervals, (Instant, Interval)):
+		# an Instant is broadcast as a degenerate (t, t) column
+		(b, e) = _endpoints(intervals) or (BOT_TIMESTAMP, BOT_TIMESTAMP)
+		return IntervalArray(numpy.full(length, b, dtype=numpy.int64), numpy.full(length, e, dtype=numpy.int64))
+	return IntervalArray.from_intervals(intervals)
+
+def _intersection_of_endpoints(a, b):
+	if a is None or b is None:
+		return Instant('', empty=True)
+	return _intersection_of_timestamps(max(a[0], b[0]), min(a[1], b[1]))
+
+def _intersection_of_timestamps(beginning, end):
+	if beginning < end:
+		return Interval.from_timestamps(beginning, end)
+	if beginning == end:
+		return Instant.from_timestamp(beginning)
+	return Instant('', empty=True)
+
+def intersects_many(left, right):
+	'''
+	a.intersects(b) for each pair of a sequence of intervals and either another sequence of the same length or a single Instant or Interval.
+	Returns a boolean array if either side is an IntervalArray, a list otherwise.
+	'''
+	if isinstance(left, IntervalArray) or isinstance(right, IntervalArray):
+		# a (t, t) column would be empty, IntervalArray.intersects compares an Instant as a point
+		if isinstance(right, Instant):
+			return _paired_arrays(left, right)[0].intersects(right)
+		if isinstance(left, Instant):
+			return _paired_arrays(left, right)[1].intersects(left)
+		(left, right) = _paired_arrays(left, right)
+		return left.intersects(right)
+	return [a is not None and b is not None and max(a[0], b[0]) <= min(a[1], b[1]) for (a, b) in _paired_endpoints(left, right)]
+
+def intersection_many(left, right):
+	'''
+	a.intersection(b) for each pair, broadcast as in intersects_many. Returns a list of time objects for any input,
+	an Instant where a and b only touch; IntervalArray.intersection keeps the result in arrays.
+	'''
+	if isinstance(left, IntervalArray) or isinstance(right, IntervalArray):
+		intersects = intersects_many(left, right).tolist()
+		(left, right) = _paired_arrays(left, right)
+		result = left.intersection(right)
+		return [_intersection_of_timestamps(b, e) if both else Instant('', empty=True)
+			for (b, e, both) in zip(result.beginning.tolist(), result.end.tolist(), intersects)]
+	return [_intersection_of_endpoints(a, b) for (a, b) in _paired_endpoints(left, right)]
+
+def difference_many(left, right):
+	'''
+	a.difference(b) for each pair, broadcast as in intersects_many. Returns a list of time objects for any input;
+	IntervalArray.difference keeps the result in arrays.
+	'''
+	# an Instant on the left is a point, which an IntervalArray cannot hold
+	if (isinstance(left, IntervalArray) or isinstance(right, IntervalArray)) and not isinstance(left, Instant):
+		(left, right) = _paired_arrays(left, right)
+		(before, after) = left.difference(right)
+		output = []
+		for (empty, b, e, b2, e2) in zip(left.is_empty.tolist(), before.beginning.tolist(), before.end.tolist(), after.beginning.tolist(), after.end.tolist()):
+			output.append(Instant('', empty=True) if empty else runs_as_time([(x, y) for (x, y) in ((b, e), (b2, e2)) if x < y]))
+		return output
+	output = []
+	for (a, b) in _paired_endpoints(left, right):
+		output.append(runs_as_time(difference_runs([a] if a is not None else [], [b] if b is not None else [])))
+	return output
+
+def _group_endpoints(items, key, spell, weight=None):
+	# lists of (endpoints, item) by group, or (endpoints, weight(item)) with a weight function
+	groups = OrderedDict()
+	for item in items:
+		endpoints = _endpoints(spell(item) if spell is not None else item)
+		if endpoints is None:
+			continue
+		group = key(item) if key is not None else None
+		if group not in groups:
+			groups[group] = []
+		groups[group].append((endpoints, weight(item) if weight is not None else item))
+	return groups
+
+def _overlapping_pairs(left, right):
+	# left and right are lists of (endpoints, item), each pair is found when its later beginning is reached
+	left.sort(key=lambda pair: pair[0])
+	right.sort(key=lambda pair: pair[0])
+	active_left = []
+	active_right = []
+	i = j = 0
+	while i < len(left) or j < len(right):
+		if j == len(right) or (i < len(left) and left[i][0][0] <= right[j][0][0]):
+			(endpoints, item) = left[i]
+			i += 1
+			active_right = [other for other in active_right if other[0][1] >= endpoints[0]]
+			for (other_endpoints, other) in active_right:
+				yield (item, other, _intersection_of_endpoints(endpoints, other_endpoints))
+			active_left.append((endpoints, item))
+		else:
+			(endpoints, item) = right[j]
+			j += 1
+			active_left = [other for other in active_left if other[0][1] >= endpoints[0]]
+			for (other_endpoints, other) in active_left:
+				yield (other, item, _intersection_of_endpoints(other_endpoints, endpoints))
+			active_right.append((endpoints, item))
+
+def overlap_join(left, right, key=None, spell=None):
+	'''
+	Yields (left item, right item, intersection) for every pair of items with the same key(item) whose intervals
+	intersect. spell(item) gives the Interval of an item, by default the item itself. Each key is joined by a sweep
+	over intervals sorted by their beginning, in O((n + m) log(n + m) + output) time.
+	'''
+	left_groups = _group_endpoints(left, key, spell)
+	right_groups = _group_endpoints(right, key, spell)
+	for (group, left_items) in left_groups.items():
+		if group in right_groups:
+			for triple in _overlapping_pairs(left_items, right_groups[group]):
+				yield triple
+
+# periods per year of each frequency of period_totals
+PERIODS_PER_YEAR = {'month': 12, 'quarter': 4, 'year': 1}
+_DAY = 86400*1000000
+
+def _period_index(timestamp, frequency):
+	moment = timestamp_as_datetime(timestamp)
+	periods = PERIODS_PER_YEAR[frequency]
+	return moment.year*periods + (moment.month-1)*periods // 12
+
+# (index, frequency) -> timestamp, a few thousand periods at most
+_period_beginnings = {}
+
+def _period_beginning(index, frequency):
+	timestamp = _period_beginnings.get((index, frequency))
+	if timestamp is None:
+		periods = PERIODS_PER_YEAR[frequency]
+		(year, position) = divmod(index, periods)
+		# the period after December 9999 would begin after EOT
+		if year > _EOT.year:
+			timestamp = EOT_TIMESTAMP
+		else:
+			timestamp = datetime_as_timestamp(datetime(year, position*12 // periods + 1, 1))
+		_period_beginnings[(index, frequency)] = timestamp
+	return timestamp
+
+def period_label(index, frequency):
+	'''
+	The name of a period of period_totals: 1991-01, 1991Q1 or 1991.
+	'''
+	periods = PERIODS_PER_YEAR[frequency]
+	(year, position) = divmod(index, periods)
+	if frequency == 'month':
+		return u'%04d-%02d' % (year, position+1)
+	if frequency == 'quarter':
+		return u'%04dQ%d' % (year, position+1)
+	return u'%04d' % year
+
+def _totals_of_group(spells, frequency, window):
+	# spells are ((beginning, end), weight); periods between the first and the last spell are swept once, with the
+	# spells that cover a period whole counted in a difference array and partial periods added at the ends
+	partial = {}
+	partial_weighted = {}
+	starts = {}
+	whole = {}
+	whole_weighted = {}
+	(first, last) = (None, None)
+	for ((b, e), w) in spells:
+		(b, e) = (max(b, window[0]), min(e, window[1]))
+		if b >= e:
+			continue
+		# an open end left unclipped would run to the beginning or the end of time
+		if b == BOT_TIMESTAMP or e == EOT_TIMESTAMP:
+			side = 'beginning' if b == BOT_TIMESTAMP else 'end'
+			raise ValueError('A spell with an open %s needs a window closed at its %s.' % (side, side))
+		i = _period_index(b, frequency)
+		j = _period_index(e, frequency)
+		# a spell ending at the beginning of a period does not overlap it
+		if _period_beginning(j, frequency) == e:
+			j -= 1
+		starts[i] = starts.get(i, 0) + 1
+		starts[j+1] = starts.get(j+1, 0) - 1
+		if i == j:
+			partial[i] = partial.get(i, 0) + (e-b)
+			partial_weighted[i] = partial_weighted.get(i, 0) + w*(e-b)
+		else:
+			head = _period_beginning(i+1, frequency)-b
+			tail = e-_period_beginning(j, frequency)
+			partial[i] = partial.get(i, 0) + head
+			partial[j] = partial.get(j, 0) + tail
+			partial_weighted[i] = partial_weighted.get(i, 0) + w*head
+			partial_weighted[j] = partial_weighted.get(j, 0) + w*tail
+			whole[i+1] = whole.get(i+1, 0) + 1
+			whole[j] = whole.get(j, 0) - 1
+			whole_weighted[i+1] = whole_weighted.get(i+1, 0) + w
+			whole_weighted[j] = whole_weighted.get(j, 0) - w
+		first = i if first is None else min(first, i)
+		last = j if last is None else max(last, j)
+	if first is None:
+		return
+	(active, covering, covering_weight) = (0, 0, 0)
+	beginning = _period_beginning(first, frequency)
+	for index in range(first, last+1):
+		end = _period_beginning(index+1, frequency)
+		active += starts.get(index, 0)
+		covering += whole.get(index, 0)
+		covering_weight += whole_weighted.get(index, 0)
+		days = float(partial.get(index, 0) + covering*(end-beginning)) / _DAY
+		weighted = float(partial_weighted.get(index, 0) + covering_weight*(end-beginning)) / _DAY
+		yield (index, days, active, weighted)
+		beginning = end
+
+def period_totals(items, frequency='month', key=None, spell=None, weight=None, window=None):
+	'''
+	Yields (group, period, days, active, weighted) for every calendar period from the first to the last spell of each
+	group, groups in order of first appearance. days is the sum of the overlaps of the spells with the period in
+	days, active is the number of spells overlapping it and weighted is days with each overlap multiplied by
+	weight(item), 1 by default. frequency is 'month', 'quarter' or 'year' and period is its period_label.
+	spell(item) gives the Interval of an item, by default the item itself, and group is key(item), or None.
+	Spells are clipped to the window Interval, if any. A spell with an open end that the window does not clip raises
+	ValueError, as it would run to the beginning or the end of time.
+	Each spell takes O(1) time and each group one sweep over its periods; no Interval is built for a period.
+	'''
+	if frequency not in PERIODS_PER_YEAR:
+		raise ValueError('Unknown frequency %r, expected one of %s.' % (frequency, ', '.join(sorted(PERIODS_PER_YEAR))))
+	if window is None:
+		window = (BOT_TIMESTAMP, EOT_TIMESTAMP)
+	else:
+		window = _endpoints(window)
+		if window is None:
+			return
+	groups = _group_endpoints(items, key, spell, weight if weight is not None else lambda item: 1)
+	for (group, spells) in groups.items():
+		for (index, days, active, weighted) in _totals_of_group(spells, frequency, window):
+			yield (group, period_label(index, frequency), days, active, weighted)
+
+def coalesce(items, tolerance=timedelta(0), key=None, spell=None, check=True):
+	'''
+	Yields (group, spell, items) for the merged spells of each group. Spells of a group are merged in order of their
+	beginning while the gap to the latest end so far is at most 'tolerance', so overlapping and touching spells are
+	always merged. Items must be sorted by key(item), if given; only the items of the current group are held in
+	memory. spell(item) gives the Interval of an item, by default the item itself. Merged items are listed in order
+	of their beginning. Items with empty spells are never merged: each is yielded alone with its empty spell, after
+	the merged spells of its group and in input order, so that no item is lost.
+	With check=True, a group that appears twice raises ValueError. The check keeps every key seen so far; with
+	check=False memory is bounded by the largest group.
+	'''
+	limit = timedelta_as_timestamp(tolerance)
+	groups = groupby(items, key) if key is not None else [(None, items)]
+	seen = set()
+	for (group, members) in groups:
+		if key is not None and check:
+			if group in seen:
+				raise ValueError('Items are not sorted by key: group %r appears twice.' % (group,))
+			seen.add(group)
+		spells = []
+		empty = []
+		for item in members:
+			interval = spell(item) if spell is not None else item
+			endpoints = _endpoints(interval)
+			if endpoints is not None:
+				spells.append((endpoints, item))
+			else:
+				empty.append((interval, item))
+		spells.sort(key=lambda pair: pair[0])
+		merged = []
+		for ((b, e), item) in spells:
+			if merged and b-end <= limit:
+				end = max(end, e)
+				merged.append(item)
+				continue
+			if merged:
+				yield (group, runs_as_time([(beginning, end)]), merged)
+			(beginning, end, merged) = (b, e, [item])
+		if merged:
+			yield (group, runs_as_time([(beginning, end)]), merged)
+		for (interval, item) in empty:
+			yield (group, interval, [item])
+
+class IntervalArray(object):
+	'''
+	A column of intervals as two int64 NumPy arrays of timestamps. Elements with end <= beginning are empty.
+	Relations and operations are elementwise against an Interval, an Instant or an IntervalArray of the same length.
+	'''
+	def __init__(self, beginning, end):
+		if numpy is None:
+			raise ImportError('IntervalArray requires NumPy.')
+		# no copy when the arrays are already int64
+		self.beginning = numpy.asarray(beginning, dtype=numpy.int64)
+		self.end = numpy.asarray(end, dtype=numpy.int64)
+		if self.beginning.shape != self.end.shape:
+			raise ValueError('beginning and end must have the same shape.')
+
+	@classmethod
+	def from_intervals(cls, intervals):
+		timestamps = [interval.timestamps if not interval.is_empty else (BOT_TIMESTAMP, BOT_TIMESTAMP) for interval in intervals]
+		if not timestamps:
+			return cls(numpy.empty(0, dtype=numpy.int64), numpy.empty(0, dtype=numpy.int64))
+		array = numpy.array(timestamps, dtype=numpy.int64)
+		return cls(array[:, 0], array[:, 1])
+
+	def __len__(self):
+		return len(self.beginning)
+
+	def __getitem__(self, index):
+		if isinstance(index, (int, long, numpy.integer)):
+			return Interval.from_timestamps(int(self.beginning[index]), int(self.end[index]))
+		return IntervalArray(self.beginning[index], self.end[index])
+
+	def __iter__(self):
+		for index in range(len(self)):
+			yield self[index]
+
+	def __unicode__(self):
+		return u'[%s]' % u', '.join([unicode(interval) for interval in self])
+
+	def __str__(self):
+		return unicode(self)
+
+	@property
+	def is_empty(self):
+		return self.end <= self.beginning
+
+	@property
+	def length(self):
+		return numpy.maximum(self.end-self.beginning, 0).astype('timedelta64[us]')
+
+	def _other_timestamps(self, other):
+		if isinstance(other, IntervalArray):
+			return (other.beginning, other.end)
+		if isinstance(other, Interval):
+			if other.is_empty:
+				return (BOT_TIMESTAMP, BOT_TIMESTAMP)
+			return other.timestamps
+		if isinstance(other, Instant):
+			# a degenerate (t, t) element
+			if other.is_empty:
+				return (BOT_TIMESTAMP, BOT_TIMESTAMP)
+			return (other.timestamp, other.timestamp)
+		raise TypeError('Expected an Instant, an Interval or an IntervalArray, not %s.' % type(other).__name__)
+
+	def intersects(self, other):
+		if isinstance(other, Instant):
+			if other.is_empty:
+				return numpy.zeros(len(self), dtype=bool)
+			return (self.beginning < self.end) & (self.beginning <= other.timestamp) & (other.timestamp <= self.end)
+		(beginning, end) = self._other_timestamps(other)
+		return (self.beginning < self.end) & (beginning < end) & (numpy.maximum(self.beginning, beginning) <= numpy.minimum(self.end, end))
+
+	def contains(self, other):
+		# as for TimelyObject.contains, an instant on the boundary is not contained
+		if isinstance(other, Instant):
+			if other.is_empty:
+				return numpy.zeros(len(self), dtype=bool)
+			return (self.beginning < other.timestamp) & (other.timestamp < self.end)
+		(beginning, end) = self._other_timestamps(other)
+		return (self.beginning < self.end) & (beginning < end) & (self.beginning <= beginning) & (end <= self.end)
+
+	def intersection(self, other):
+		'''
+		Closed, as for Interval.intersection, but an IntervalArray cannot hold an Instant. Where intersects(other) is
+		True, an element (t, t) is the Instant t, e.g. for intervals that only touch; elsewhere the element is empty.
+		'''
+		(beginning, end) = self._other_timestamps(other)
+		return IntervalArray(numpy.maximum(self.beginning, beginning), numpy.minimum(self.end, end))
+
+	def difference(self, other):
+		'''
+		Two IntervalArrays: the parts of each element before and after other.
+		'''
+		(beginning, end) = self._other_timestamps(other)
+		other_is_empty = end <= beginning
+		before = IntervalArray(self.beginning, numpy.where(other_is_empty, self.end, numpy.minimum(self.end, beginning)))
+		after = IntervalArray(numpy.where(other_is_empty, self.end, numpy.maximum(self.beginning, end)), self.end)
+		return (before, after)
+
+	def offset(self, difference):
+		shift = timedelta_as_timestamp(difference)
+		# open ends stay at the beginning and end of time
+		beginning = numpy.where(self.beginning == BOT_TIMESTAMP, self.beginning, self.beginning+shift)
+		end = numpy.where(self.end == EOT_TIMESTAMP, self.end, self.end+shift)
+		return IntervalArray(beginning, end)
+
+class _Node(object):
+	__slots__ = ('interval', 'beginning', 'end', 'priority', 'left', 'right', 'max_end')
+
+	def __init__(self, interval, priority):
+		self.interval = interval
+		(self.beginning, self.end) = interval.timestamps
+		self.priority = priority
+		self.left = self.right = None
+		self.max_end = self.end
+
+	def update(self):
+		self.max_end = self.end
+		if self.left is not None and self.left.max_end > self.max_end:
+			self.max_end = self.left.max_end
+		if self.right is not None and self.right.max_end > self.max_end:
+			self.max_end = self.right.max_end
+
+def _rotate_right(node):
+	left = node.left
+	node.left = left.right
+	left.right = node
+	node.update()
+	left.update()
+	return left
+
+def _rotate_left(node):
+	right = node.right
+	node.right = right.left
+	right.left = node
+	node.update()
+	right.update()
+	return right
+
+def _insert(node, new):
+	if node is None:
+		return new
+	if (new.beginning, new.end) < (node.beginning, node.end):
+		node.left = _insert(node.left, new)
+		if node.left.priority > node.priority:
+			return _rotate_right(node)
+	else:
+		node.right = _insert(node.right, new)
+		if node.right.priority > node.priority:
+			return _rotate_left(node)
+	node.update()
+	return node
+
+def _merge(left, right):
+	if left is None:
+		return right
+	if right is None:
+		return left
+	if left.priority > right.priority:
+		left.right = _merge(left.right, right)
+		left.update()
+		return left
+	right.left = _merge(left, right.left)
+	right.update()
+	return right
+
+def _remove(node, key):
+	if node is None:
+		raise ValueError('Interval is not in the index.')
+	if key < (node.beginning, node.end):
+		node.left = _remove(node.left, key)
+	elif key > (node.beginning, node.end):
+		node.right = _remove(node.right, key)
+	else:
+		return _merge(node.left, node.right)
+	node.update()
+	return node
+
+def _build(nodes):
+	if not nodes:
+		return None
+	middle = len(nodes) // 2
+	node = nodes[middle]
+	node.left = _build(nodes[:middle])
+	node.right = _build(nodes[middle+1:])
+	node.update()
+	return node
+
+def _set_priorities(root, size, random):
+	# a balanced tree is a treap if priorities decrease level by level
+	priorities = iter(sorted([random.random() for index in range(size)], reverse=True))
+	level = [root] if root is not None else []
+	while level:
+		for node in level:
+			node.priority = next(priorities)
+		level = [child for node in level for child in (node.left, node.right) if child is not None]
+
+class IntervalIndex(object):
+	'''
+	An interval treap augmented with the largest end in each subtree. Overlap and stabbing queries take O(log n + k),
+	nearest neighbours, inserts and deletes O(log n), all expected. Empty intervals are not indexed.
+	'''
+	def __init__(self, intervals=()):
+		self.random = random.Random()
+		nodes = [_Node(interval, 0) for interval in intervals if not interval.is_empty]
+		nodes.sort(key=lambda node: (node.beginning, node.end))
+		self.root = _build(nodes)
+		self.size = len(nodes)
+		_set_priorities(self.root, len(nodes), self.random)
+
+	@classmethod
+	def from_array(cls, array):
+		return cls(array[index] for index in range(len(array)))
+
+	def __len__(self):
+		return self.size
+
+	def __iter__(self):
+		stack = []
+		node = self.root
+		while stack or node is not None:
+			if node is not None:
+				stack.append(node)
+				node = node.left
+			else:
+				node = stack.pop()
+				yield node.interval
+				node = node.right
+
+	def insert(self, interval):
+		if interval.is_empty:
+			return
+		self.root = _insert(self.root, _Node(interval, self.random.random()))
+		self.size += 1
+
+	def remove(self, interval):
+		'''
+		Removes one interval with the same endpoints as 'interval'. Raises ValueError if there is none.
+		'''
+		if interval.is_empty:
+			raise ValueError('Interval is not in the index.')
+		self.root = _remove(self.root, interval.timestamps)
+		self.size -= 1
+
+	def _query(self, beginning, end):
+		output = []
+		stack = [self.root]
+		while stack:
+			node = stack.pop()
+			# no interval in this subtree reaches the query
+			if node is None or node.max_end < beginning:
+				continue
+			if node.beginning <= end:
+				if node.end >= beginning:
+					output.append(node)
+				stack.append(node.right)
+			stack.append(node.left)
+		output.sort(key=lambda node: (node.beginning, node.end))
+		return [node.interval for node in output]
+
+	def overlap(self, other):
+		'''
+		Indexed intervals that intersect 'other', an Instant or an Interval, in order of their beginning.
+		'''
+		if other.is_empty:
+			return []
+		(beginning, end) = runs(other)[0]
+		return self._query(beginning, end)
+
+	def stab(self, instant):
+		'''
+		Indexed intervals that intersect 'instant', including those that begin or end at it.
+		'''
+		return self.overlap(instant)
+
+	def nearest(self, other):
+		'''
+		The indexed interval closest to 'other' and its distance, or (None, None) if the index is empty.
+		'''
+		if self.root is None or other.is_empty:
+			return (None, None)
+		(beginning, end) = runs(other)[0]
+		overlapping = self._query(beginning, end)
+		if overlapping:
+			return (overlapping[0], timedelta(0))
+		# with no overlaps, intervals beginning before 'other' end before it, too
+		before = None
+		after = None
+		node = self.root
+		while node is not None:
+			if node.beginning <= end:
+				if node.left is not None and (before is None or node.left.max_end > before.end):
+					before = self._latest_end(node.left)
+				if before is None or node.end > before.end:
+					before = node
+				node = node.right
+			else:
+				after = node
+				node = node.left
+		candidates = []
+		if before is not None:
+			candidates.append((beginning-before.end, before))
+		if after is not None:
+			candidates.append((after.beginning-end, after))
+		(distance, node) = min(candidates, key=lambda candidate: candidate[0])
+		return (node.interval, timestamp_as_timedelta(distance))
+
+	def _latest_end(self, node):
+		while True:
+			if node.end == node.max_end:
+				return node
+			if node.left is not None and node.left.max_end == node.max_end:
+				node = node.left
+			else:
+				node = node.right
+
+class _StepNode(object):
+	# a change in coverage at 'timestamp', with a summary of the step function over the subtree:
+	# its first and last timestamps, the sum of its changes, and the lowest count between its first and last
+	# timestamps, relative to the count before the subtree, with the total length at that count
+	__slots__ = ('timestamp', 'change', 'priority', 'left', 'right', 'first', 'last', 'total', 'low', 'low_length')
+
+	def __init__(self, timestamp, change, priority):
+		self.timestamp = timestamp
+		self.change = change
+		self.priority = priority
+		self.left = self.right = None
+		self.update()
+
+	def update(self):
+		# the lowest count and its length over the segments of the left subtree, the segments before and
+		# after this timestamp, and the segments of the right subtree, in order; low is None without segments
+		timestamp = self.timestamp
+		count = self.change
+		low = None
+		low_length = 0
+		left = self.left
+		if left is None:
+			self.first = timestamp
+		else:
+			self.first = left.first
+			(low, low_length) = (left.low, left.low_length)
+			before = left.total
+			length = timestamp-left.last
+			if low is None or before < low:
+				(low, low_length) = (before, length)
+			elif before == low:
+				low_length += length
+			count += before
+		right = self.right
+		if right is None:
+			self.last = timestamp
+		else:
+			self.last = right.last
+			length = right.first-timestamp
+			if low is None or count < low:
+				(low, low_length) = (count, length)
+			elif count == low:
+				low_length += length
+			if right.low is not None:
+				after = count+right.low
+				if after < low:
+					(low, low_length) = (after, right.low_length)
+				elif after == low:
+					low_length += right.low_length
+			count += right.total
+		(self.low, self.low_length) = (low, low_length)
+		self.total = count
+
+def _change_at(node, timestamp, change, priority):
+	if node is None:
+		return _StepNode(timestamp, change, priority)
+	if timestamp < node.timestamp:
+		node.left = _change_at(node.left, timestamp, change, priority)
+		# the change may have removed the child instead
+		if node.left is not None and node.left.priority > node.priority:
+			return _rotate_right(node)
+	elif timestamp > node.timestamp:
+		node.right = _change_at(node.right, timestamp, change, priority)
+		if node.right is not None and node.right.priority > node.priority:
+			return _rotate_left(node)
+	else:
+		node.change += change
+		# the step function no longer changes here
+		if not node.change:
+			return _merge(node.left, node.right)
+	node.update()
+	return node
+
+class Timeline(object):
+	'''
+	A mutable collection of intervals that keeps the number of intervals covering each point of the timeline
+	as a treap of the points where that number changes. add and remove take O(log n) expected time, so do
+	count_at and length; union and coverage take O(k) in the number of changes and are cached between updates.
+	Coverage is counted like coverage_counts: an interval covers its beginning but not its end.
+	'''
+	def __init__(self, what=()):
+		self.random = random.Random()
+		self.intervals = {}
+		self.size = 0
+		self._union = None
+		# a TimelyObject seeds the timeline with its runs, anything else is an iterable of Intervals
+		pairs = runs(what) if isinstance(what, TimelyObject) else [interval.timestamps for interval in what if not interval.is_empty]
+		changes = {}
+		for (b, e) in pairs:
+			if b < e:
+				self.intervals[(b, e)] = self.intervals.get((b, e), 0) + 1
+				self.size += 1
+				changes[b] = changes.get(b, 0) + 1
+				changes[e] = changes.get(e, 0) - 1
+		nodes = [_StepNode(t, change, 0) for (t, change) in sorted(changes.items()) if change]
+		self.root = _build(nodes)
+		_set_priorities(self.root, len(nodes), self.random)
+
+	def __len__(self):
+		return self.size
+
+	def _change(self, beginning, end, change):
+		self.root = _change_at(self.root, beginning, change, self.random.random())
+		self.root = _change_at(self.root, end, -change, self.random.random())
+		self._union = None
+
+	def add(self, interval):
+		if interval.is_empty:
+			return
+		key = interval.timestamps
+		self.intervals[key] = self.intervals.get(key, 0) + 1
+		self.size += 1
+		self._change(key[0], key[1], 1)
+
+	def remove(self, interval):
+		'''
+		Removes one interval with the same endpoints as 'interval'. Raises ValueError if there is none.
+		'''
+		key = interval.timestamps
+		if interval.is_empty or key not in self.intervals:
+			raise ValueError('Interval is not in the timeline.')
+		self.intervals[key] -= 1
+		if not self.intervals[key]:
+			del self.intervals[key]
+		self.size -= 1
+		self._change(key[0], key[1], -1)
+
+	@property
+	def length(self):
+		'''
+		The length of the union.
+		'''
+		root = self.root
+		if root is None:
+			return timedelta(0)
+		# counts are never negative, so the lowest count is zero wherever there is a gap
+		gaps = root.low_length if root.low == 0 else 0
+		return timestamp_as_timedelta(root.last-root.first-gaps)
+
+	def count_at(self, instant):
+		'''
+		The number of intervals covering 'instant'.
+		'''
+		timestamp = instant.timestamp
+		if timestamp is None:
+			return 0
+		count = 0
+		node = self.root
+		while node is not None:
+			if timestamp < node.timestamp:
+				node = node.left
+			else:
+				count += node.change
+				if node.left is not None:
+					count += node.left.total
+				node = node.right
+		return count
+
+	def _steps(self):
+		# (timestamp, count from timestamp on) in order
+		stack = []
+		node = self.root
+		count = 0
+		while stack or node is not None:
+			if node is not None:
+				stack.append(node)
+				node = node.left
+			else:
+				node = stack.pop()
+				count += node.change
+				yield (node.timestamp, count)
+				node = node.right
+
+	@property
+	def union(self):
+		'''
+		The union of the intervals as a MultiInterval.
+		'''
+		if self._union is None:
+			list_of_runs = []
+			beginning = None
+			for (t, count) in self._steps():
+				if beginning is None:
+					beginning = t
+				elif not count:
+					list_of_runs.append((beginning, t))
+					beginning = None
+			self._union = MultiInterval.from_timestamps(list_of_runs)
+		return self._union
+
+	def coverage(self):
+		'''
+		Same as coverage_counts of the intervals in the timeline.
+		'''
+		steps = list(self._steps())
+		return [(Interval.from_timestamps(b, e), count) for ((b, count), (e, following)) in zip(steps, steps[1:])]
 
+# TIMELY_PROFILE=1 profiles the whole run and writes the summary as JSON to stderr at exit,
+# any other value is taken as the path of the JSON file
+if os.environ.get('TIMELY_PROFILE'):
+	atexit.register(enable_profiling().dump, None if os.environ['TIMELY_PROFILE'] == '1' else os.environ['TIMELY_PROFILE'])